@@ -6,13 +6,13 @@ block_cipher = None
 
 
 a = Analysis(['../src/app.py'],
-             pathex=['./lib'],
+             pathex=[],
              binaries=[],
              datas=[('../src/data/simdata.pckl', '.')],
              hiddenimports=['scipy.special.cython_special', 'pkg_resources.py2_warn'],
-             hookspath=['./hooks'],
+             hookspath=[],
              runtime_hooks=[],
-             excludes=[],
+             excludes=['sklearn', 'tkinter', 'matplotlib'],
              win_no_prefer_redirects=False,
              win_private_assemblies=False,
              cipher=block_cipher,
@@ -1,5 +1,6 @@
 from PySide2 import QtWidgets, QtCore, QtGui
 from PlotWidget import PlotWidget
+from threading import Thread
 import sys
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -13,8 +14,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setCentralWidget(self.window_widget)
         self.setMinimumSize(1500, 500)
         
-        self.stream = sensor.stream
-
         # Create the plot widget to use as the central widget
         self.plot_widget = PlotWidget(sensor)
         self.main_layout.addWidget(self.plot_widget)
@@ -63,6 +62,23 @@ class MainWindow(QtWidgets.QMainWindow):
         export_option.triggered.connect(self.export_csv)
         file_menu.addAction(export_option)
 
+        profile_option = QtGui.QAction("Show profile", self)
+        profile_option.setShortcut("Ctrl+P")
+        profile_option.setStatusTip("Print how long each stage of processing has been taking")
+        profile_option.triggered.connect(self.show_profile)
+        run_menu.addAction(profile_option)
+
+        analytics_option = QtGui.QAction("Show bowing analytics", self)
+        analytics_option.setShortcut("Ctrl+B")
+        analytics_option.setStatusTip("Print statistics of the bowing's stability and strokes since the last reset")
+        analytics_option.triggered.connect(self.show_analytics)
+        run_menu.addAction(analytics_option)
+
+        save_profile_option = QtGui.QAction("Save profile...", self)
+        save_profile_option.setStatusTip("Save how long each stage of processing has been taking, with histograms")
+        save_profile_option.triggered.connect(self.save_profile)
+        file_menu.addAction(save_profile_option)
+
         # Create the output console
         self.console = QtGui.QTextEdit()
         self.console.moveCursor(QtGui.QTextCursor.Start)
@@ -103,6 +119,7 @@ class MainWindow(QtWidgets.QMainWindow):
     # Clears plots and data
     def reset_recording(self):
         self.plot_widget.sensor.reset_recording()
+        self.plot_widget.clear()
         self.toggle_button.setText("Start Recording")
 
 
@@ -110,13 +127,48 @@ class MainWindow(QtWidgets.QMainWindow):
     def export_csv(self):
         filename, _ = QtGui.QFileDialog.getSaveFileName(self, "Export data", "export.csv", "CSV files (*.csv)")
 
+        # Exporting a long session takes a while, so don't hold up the UI
         if(filename):
-            self.plot_widget.sensor.export_accumulated_data(filename)
+            Thread(target=self.plot_widget.sensor.export_accumulated_data, args=(filename,)).start()
     
 
+    # Prints the timing of each stage of processing to the console
+    def show_profile(self):
+        profiler = self.plot_widget.sensor.profiler
+
+        if profiler:
+            print(profiler.report())
+
+        else:
+            print("Profiling is off. Set PROFILE = True in config.py to turn it on.")
+
+
+    # Prints statistics of the bowing so far to the console
+    def show_analytics(self):
+        sensor = self.plot_widget.sensor
+
+        with sensor.lock:
+            print(sensor.analytics.report())
+
+
+    # Saves the timing of each stage of processing, and their histograms, as JSON
+    def save_profile(self):
+        profiler = self.plot_widget.sensor.profiler
+
+        if not profiler:
+            print("Profiling is off. Set PROFILE = True in config.py to turn it on.")
+            return
+
+        filename, _ = QtGui.QFileDialog.getSaveFileName(self, "Save profile", "profile.json", "JSON files (*.json)")
+
+        if(filename):
+            profiler.dump(filename)
+            print(f"Saved profile to {filename}")
+
+
     # Override to close stream safely
     def closeEvent(self, event):
-        self.stream.close()
+        self.plot_widget.sensor.close()
         sys.stdout = sys.__stdout__
 
         event.accept()
@@ -1,15 +1,18 @@
 import pyqtgraph as pg
-import pandas as pd
 
 from datetime import datetime
 from queue import Queue, Empty
 from threading import Thread
 
 import config, tools
+from buffers import WindowBuffer, RollingExtrema
 
 # A widget to be added to a Qt interface.
 # PlotWidget.update should be called on loop via a QTimer to keep the plots and data updated.
+# Only the last config.HISTORY points are plotted, and they are kept in fixed-size buffers (along with
+# their extents) as new data comes in, so drawing a frame costs the same however long the session runs.
 class PlotWidget(pg.GraphicsLayoutWidget):
+    SERIES = ("time_sec", "position", "velocity", "projected_X", "projected_Y")
 
     def __init__(self, sensor):
         pg.GraphicsLayoutWidget.__init__(self) # super() doesn't seem to work here
@@ -18,16 +21,39 @@ class PlotWidget(pg.GraphicsLayoutWidget):
         self.curves      = { key: plot.plot() for key, plot in self.plots.items() }
         self.sensor      = sensor
 
+        self.history     = { key: WindowBuffer(config.HISTORY) for key in self.SERIES }
+        self.extents     = { key: RollingExtrema(config.HISTORY) for key in self.SERIES if key != "time_sec" }
+
 
     # The widget's GUI loop. Should be called regularly to keep the sensor and plot up to date.
     def update(self):
-        try: 
-            # Always get and process new data, if available
-            self.sensor.process_next_batch()
+        if self.sensor.processing_thread is not None:
+            # The sensor processes its data on its own thread, so all that's left here is to draw it
+            new_batches = self.sensor.take_results()
+
+        else:
+            new_batches = self._process_waiting_batches()
+
+        # Only redraw if there's something new
+        if new_batches:
+            for new_data in new_batches:
+                self._add_points(new_data)
 
-            # Update the plots with the new data, if we're recording
-            #if(self.sensor.should_record):
             self._update_graphics()
+            self.sensor.note_displayed()
+
+
+    def _process_waiting_batches(self):
+        new_batches = []
+
+        try: 
+            # Always get and process new data, if available. If several batches are waiting, catch up on
+            # all of them (up to as many as the queue holds, so we can't get stuck here) before redrawing
+            for _ in range(self.sensor.data_queue.maxsize):
+                new_data = self.sensor.process_next_batch()
+
+                if new_data is not None:
+                    new_batches.append(new_data)
         
         except Empty:
             # No more data is ready yet, let's not hold up the main UI
@@ -42,40 +68,46 @@ class PlotWidget(pg.GraphicsLayoutWidget):
             # Anything else that could go wrong
             print(repr(ex))
 
+        return new_batches
+
+
+    # Clear out the plotted history, ie. after the sensor's recording is reset
+    def clear(self):
+        for buffer in self.history.values():
+            buffer.clear()
 
-    # Grab the latest accumulated data from the sensor and plot it
+        for extrema in self.extents.values():
+            extrema.clear()
+
+        self._update_graphics()
+
+
+    # Push newly processed data into the plotted history
+    def _add_points(self, new_data):
+        for key, buffer in self.history.items():
+            buffer.push(new_data[key].to_numpy())
+
+        for key, extrema in self.extents.items():
+            extrema.push(new_data[key].to_numpy())
+
+
+    # Plot the latest history
     def _update_graphics(self):
-        self.curves["position"].setData(
-            self.sensor.accumulated_processed.time_sec.tail(config.HISTORY).reset_index(drop = True), # pg depends on the first index being 0
-            self.sensor.accumulated_processed.position.tail(config.HISTORY).reset_index(drop = True)
-        )
-
-        self.curves["velocity"].setData(
-            self.sensor.accumulated_processed.time_sec.tail(config.HISTORY).reset_index(drop = True),
-            self.sensor.accumulated_processed.velocity.tail(config.HISTORY).reset_index(drop = True)
-        )
-
-        self.curves["projection"].setData(
-            self.sensor.accumulated_processed.projected_X.tail(config.HISTORY).reset_index(drop = True),
-            self.sensor.accumulated_processed.projected_Y.tail(config.HISTORY).reset_index(drop = True)
-        )
-
-        self.plots["position"].setYRange(
-            min(-0.2, self.sensor.accumulated_processed.position.min()),
-            max( 0.2, self.sensor.accumulated_processed.position.max())
-        )
-
-        self.plots["velocity"].setYRange(
-            min(-0.2, self.sensor.accumulated_processed.velocity.min()),
-            max( 0.2, self.sensor.accumulated_processed.velocity.max())
-        )
-
-        self.plots["projection"].setXRange(
-            min(-0.1, self.sensor.accumulated_processed.projected_X.min()),
-            max( 0.1, self.sensor.accumulated_processed.projected_X.max())
-        )
-
-        self.plots["projection"].setYRange(
-            min(-0.1, self.sensor.accumulated_processed.projected_Y.min()),
-            max( 0.1, self.sensor.accumulated_processed.projected_Y.max())
-        )
\ No newline at end of file
+        history = { key: buffer.values() for key, buffer in self.history.items() }
+
+        self.curves["position"].setData(history["time_sec"], history["position"])
+        self.curves["velocity"].setData(history["time_sec"], history["velocity"])
+        self.curves["projection"].setData(history["projected_X"], history["projected_Y"])
+
+        self.plots["position"].setYRange(*axis_range(self.extents["position"], 0.2))
+        self.plots["velocity"].setYRange(*axis_range(self.extents["velocity"], 0.2))
+        self.plots["projection"].setXRange(*axis_range(self.extents["projected_X"], 0.1))
+        self.plots["projection"].setYRange(*axis_range(self.extents["projected_Y"], 0.1))
+
+
+# The range of an axis showing values with the given extrema, always including at least [-margin, margin]
+def axis_range(extrema, margin):
+    if extrema.min is None:
+        return -margin, margin
+
+    return min(-margin, extrema.min), max(margin, extrema.max)
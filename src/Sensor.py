@@ -1,135 +1,410 @@
-from queue import Queue, Empty
+from queue import Empty
 from datetime import datetime
-from threading import Thread
+from threading import Event, RLock, Thread
 import pandas as pd
-import time
+import numpy as np
+import time, warnings
 
-import config, tools
+import analytics, config, positioning, recordings
+from buffers import ColumnBuffer, SpillingColumnBuffer
+from profiling import NO_PROFILER, Profiler
+from publish import Publisher
+from positioning import MODES, PROCESSED_COLUMNS, PROCESSED_TIME, RAW_COLUMNS, TIME_INDEX
+from queues import BoundedQueue
+from scheduling import BatchScheduler
+
+
+# Lines of sensor data start with this prefix
+DATA_PREFIX = b"mugicdata "
 
 
 # An interface to the data coming in from the sensor.
 # Anybody who would like to alter the way the positioning is calculated would
-# want to modify Sensor.calculate_position, and perhaps Sensor.process_next_batch (which calls it)
+# want to modify positioning.py, and perhaps Sensor.process_batch (which calls it)
 class Sensor:
-    def __init__(self, stream, batch_size = config.BATCH_SIZE, reuse_size = config.REUSE_SIZE):
+    # fetch: whether to start a thread that reads the stream into data_queue, for process_next_batch.
+    # Without it, read the stream yourself and pass the batches to process_batch.
+    # process_in_background: whether to also start a thread that processes the fetched batches as they come in,
+    # so the GUI only has to collect the results (with take_results) rather than calling process_next_batch
+    # session_path: if given, raw and processed data are also written to <session_path>.raw.mrec
+    # and <session_path>.processed.mrec as they're accumulated (see recordings.SessionRecorder)
+    # publish_to: subscribers to send the processed data to live, as they're processed (see publish.Publisher)
+    # compact: whether to store the accumulated data in single precision (except for the time), for long sessions
+    # optional_columns: other columns of config.COLUMNS to keep along with the raw data (eg. "BatteryPercent"),
+    # which aren't used for positioning but are exported with everything else
+    # spill: whether to keep only the data the algorithm needs in memory, moving older data out to temporary files
+    # (see buffers.SpillingColumnBuffer), so memory use stays constant however long the session is
+    # profile: whether to time each stage of processing (see profiling.Profiler, kept in self.profiler)
+    # cutoff, order: the high pass filters' cutoff frequency (in Hz) and order, for the windowed and streaming modes
+    # adaptive: whether the fetched batches' size should adapt to how fast processing is (see scheduling.BatchScheduler),
+    # starting from batch_size, and batches that queue up be processed together
+    def __init__(self, stream, batch_size = config.BATCH_SIZE, reuse_size = config.REUSE_SIZE, mode = config.POSITIONING_MODE,
+                 fetch = True, process_in_background = config.PROCESS_IN_BACKGROUND, session_path = config.SESSION_PATH,
+                 publish_to = config.PUBLISH_TO, compact = config.COMPACT_STORAGE, optional_columns = config.OPTIONAL_COLUMNS,
+                 adaptive = config.ADAPTIVE_BATCHING, spill = config.SPILL_TO_DISK, cutoff = config.FILTER_CUTOFF_HZ,
+                 order = config.FILTER_ORDER, profile = config.PROFILE):
+        assert mode in MODES, f"Unknown positioning mode {mode}"
+
         self.stream = stream
         self.batch_size = batch_size
         self.reuse_size = reuse_size
-        self.data_queue = Queue()
+        self.mode = mode
+        self.cutoff = cutoff
+        self.order = order
+        self.profiler = Profiler() if profile else NO_PROFILER
+        self.compact = compact
+        self.spill = spill
+        self.accumulated_raw = self.accumulated_processed = None
+        self.raw_columns = RAW_COLUMNS + [col for col in optional_columns if col not in RAW_COLUMNS]
+        self.data_queue = BoundedQueue(config.QUEUE_SIZE, config.QUEUE_POLICY, merge = merge_batches)
+        self.corrupt_lines = 0
+
+        # For measuring latency: how far the sensor's clock is behind ours, the times (by the sensor's clock)
+        # of the newest fetched and processed samples, and how long ago that sample was taken when it was last displayed
+        self.clock_offset = float("inf")
+        self.last_sample_time = float("-inf")
+        self.last_processed_time = None
+        self.latency = None
+        self.max_latency = 0.0
+
+        self.session_path = session_path
+        self.recorder = None
+
+        self.publisher = Publisher(publish_to) if publish_to else None
+
+        # Only fetched batches can be resized
+        self.scheduler = BatchScheduler(batch_size) if adaptive and fetch else None
+        self.last_arrival_time = None
+
+        # The positioning algorithm writes its output here, rather than to a new array every batch. There's room for
+        # the reuse window and the largest batch; it grows if more has to be processed at once (eg. the calibration)
+        max_batch_size = self.scheduler.max_batch_size if self.scheduler is not None else batch_size
+        self.output = np.empty((reuse_size + max_batch_size, len(PROCESSED_COLUMNS)))
+
+        # Held while a batch is processed, so the data isn't reset or exported out from under it
+        self.lock = RLock()
+        self.generation = 0 # incremented on every reset
 
         self.reset_recording()
 
         self.done_calibrating = False
 
-        fetching_thread = Thread(target=retrieve_new_data, args=(self.stream, self.batch_size, self.data_queue))
-        fetching_thread.start()
+        # The processing thread's newly processed data, as (generation, DataFrame), merged together if not collected
+        # (keeping only the latest config.HISTORY rows, so memory stays bounded if nobody collects them;
+        # everything is still in accumulated_processed)
+        self.results = BoundedQueue(1, "coalesce", merge = merge_results)
+        self.processing_thread = None
+        self.stopped = Event()
+
+        if fetch:
+            n_lines = (lambda: self.scheduler.batch_size) if self.scheduler is not None else self.batch_size
+            fetching_thread = Thread(target=retrieve_new_data, args=(self.stream, n_lines, self.data_queue, self.profiler))
+            fetching_thread.start()
 
+            if process_in_background:
+                self.processing_thread = Thread(target=self._process_in_background, daemon=True)
+                self.processing_thread.start()
 
-    # The positioning algorithm.
-    # Given batches of raw samples, attempt to determine current velocity and position, as well as
-    # the first principal components of those measurements and a projection of position onto the 
-    # other two components. 
+
+    # The positioning algorithm (see positioning.py), on a DataFrame of raw samples (holding at least RAW_COLUMNS),
+    # returning a DataFrame of PROCESSED_COLUMNS. In the windowed mode, the samples are the reuse window and the
+    # new batch, and the integration correction connects them to the data processed so far.
     def calculate_position(self, samples, integration_correction = True):
-        raw_acceleration = samples[["ax", "ay", "az"]]
+        return processed_frame(self._calculate_position(samples[RAW_COLUMNS].to_numpy(), integration_correction))
 
-        rotation_matrices = tools.quaternions_as_rotation_matrix(samples.qw, samples.qx, samples.qy, samples.qz)
-        linear_acceleration = tools.rotate_each_row(raw_acceleration, rotation_matrices)
 
-        # Get dataframes of velocity and x,y,z
-        velocity = linear_acceleration \
-            .apply(lambda col: tools.filter_and_integrate(col, samples.time_sec))
+    # The same, on an array of RAW_COLUMNS, returning an array of PROCESSED_COLUMNS.
+    # The array is a view of self.output, so it's only valid until the next call.
+    def _calculate_position(self, samples, integration_correction = True):
+        history = None
 
-        if integration_correction:
-            mean_old_v = self.accumulated_processed \
-                .tail(self.reuse_size - self.batch_size)[["vx", "vy", "vz"]] \
-                .mean(axis = 0)
+        if integration_correction and self.mode == "windowed":
+            history = self.accumulated_processed.array(PROCESSED_COLUMNS, self.reuse_size - self.batch_size)
 
-            mean_new_v = velocity \
-                .head(self.reuse_size - self.batch_size) \
-                .mean(axis = 0)
+        if samples.shape[0] > self.output.shape[0]:
+            self.output = np.empty((max(samples.shape[0], 2 * self.output.shape[0]), len(PROCESSED_COLUMNS)))
 
-            offset = mean_old_v.to_numpy() - mean_new_v.to_numpy() # to numpy bc of the different colnames :(
-            velocity = velocity.apply(lambda row: row + offset, axis = 1)
+        return self.positioner.process(samples, history, out = self.output[:samples.shape[0]])
 
-        position = velocity \
-            .apply(lambda col: tools.filter_and_integrate(col, samples.time_sec))
 
-        if integration_correction:
-            mean_old_p = self.accumulated_processed \
-                .tail(self.reuse_size - self.batch_size)[["x", "y", "z"]] \
-                .mean(axis = 0)
+    # Note that the data withheld for calibration won't have been processed, but will be exported.
+    # If the session is being recorded to disk, the CSV is converted from there a chunk at a time.
+    def export_accumulated_data(self, filename):
+        log_message(2, "Exporting accumulated data")
 
-            mean_new_p = position \
-                .head(self.reuse_size - self.batch_size) \
-                .mean(axis = 0)
+        if self.recorder is not None:
+            self.recorder.flush()
+            recordings.session_to_csv(self.recorder.path_prefix, filename)
 
-            offset = mean_old_p.to_numpy() - mean_new_p.to_numpy()
-            position = position.apply(lambda row: row + offset, axis = 1)
+        elif self.spill:
+            # Much of the data may only be on disk, so it's written out a chunk at a time, rather than all loaded.
+            # Only taking the snapshots holds up processing, not writing them out
+            with self.lock:
+                raw, processed = self.accumulated_raw.snapshot(), self.accumulated_processed.snapshot()
 
-        _, velocity_PCs = tools.PCA(velocity)
-        position_matrix, position_PCs = tools.PCA(position)
+            recordings.tables_to_csv(raw, processed, filename)
 
-        eig1 = position_matrix[:, 0]
-        new_points = tools.project_3D_to_2D(position.to_numpy(), eig1)
+        else:
+            with self.lock:
+                raw, processed = self.accumulated_raw.to_frame(), self.accumulated_processed.to_frame()
 
-        return pd.DataFrame({
-            "time_sec":    samples.time_sec.values, # .values removes the pd index that throws off DataFrame()
-            "position":    position_PCs.PC1,
-            "x":           position.ax,
-            "y":           position.ay,
-            "z":           position.az,
-            "velocity":    velocity_PCs.PC1,
-            "vx":          velocity.ax,
-            "vy":          velocity.ay,
-            "vz":          velocity.az,
-            "projected_X": new_points[:, 0],
-            "projected_Y": new_points[:, 1]
-        })
+            pd.merge(raw, processed, how = "outer", on = "time_sec").to_csv(filename)
 
+        log_message(2, f"Exported accumulated data to {filename}")
 
-    # Note that the data withheld for calibration won't have been processed, but will be exported    
-    def export_accumulated_data(self, filename):
-        log_message(2, "Exporting accumulated data")
 
-        pd.merge(self.accumulated_raw, self.accumulated_processed, how = "outer", on = "time_sec") \
-            .to_csv(filename)
+    # Accumulates and analyzes the next batch of data. This is to be called reguarly from the GUI loop,
+    # unless the sensor is processing in the background. Raises queue.Empty if no new batch has been fetched yet.
+    def process_next_batch(self, block = False):
+        batch = self.data_queue.get(block, timeout = 0.1)
 
+        if self.profiler:
+            self.profiler.record("queue_wait", time.time() - batch[0]) # from being fetched until now
 
-    # Accumulates and analyzes the next batch of data. This is to be called reguarly from the GUI loop.
-    def process_next_batch(self):
-        samples = parse_bytes(self.data_queue.get_nowait())
+        if self.scheduler is None:
+            with self.lock:
+                return self.process_batch(batch[1], batch[0])
 
-        # Always collect data to keep the queue fresh, but throw it out if we don't want it
-        if(self.should_record):
-            self._accumulate_raw_data(samples)
+        # We're falling behind, so catch up on everything that's waiting in one go
+        while self.data_queue.qsize():
+            batch = merge_batches(batch, self.data_queue.get_nowait())
+
+        arrival_time, raw_data = batch
+        previous_arrival_time, self.last_arrival_time = self.last_arrival_time, arrival_time
+        calibrating = self.should_record and not self.done_calibrating
+
+        with self.lock:
+            start = time.perf_counter()
+            new_data = self.process_batch(raw_data, arrival_time)
+            processing_seconds = time.perf_counter() - start
+
+        # The calibration is a one-off, so it says nothing about how long batches take
+        if new_data is not None and not calibrating and previous_arrival_time is not None:
+            decision = self.scheduler.record(
+                len(new_data), arrival_time - previous_arrival_time, processing_seconds,
+                backlog = self.data_queue.qsize(), time_sec = self.last_sample_time
+            )
+
+            if decision is not None:
+                log_message(2, f"Batch size {decision['from']} -> {decision['to']}: {decision['reason']}")
+
+        return new_data
+
+
+    # When processing in the background, collects the data processed since the last call (or at least
+    # the latest config.HISTORY rows of it, as many as are plotted), as a list of DataFrames
+    def take_results(self):
+        try:
+            generation, new_data = self.results.get_nowait()
+
+        except Empty:
+            return []
+
+        return [new_data] if generation == self.generation else []
+
+
+    # The processing thread's loop, which keeps processing batches until the sensor is closed
+    def _process_in_background(self):
+        while not self.stopped.is_set():
+            try:
+                generation = self.generation
+                new_data = self.process_next_batch(block = True)
+
+                if new_data is not None:
+                    self.results.put((generation, new_data))
+
+            except Empty:
+                # Nothing was fetched in a while; check whether we're closed, then keep waiting
+                pass
+
+            except AssertionError:
+                # We haven't collected enough data to begin analysis yet
+                # (reuse_size > amount of accumulated data)
+                print("Withholding data for calibration")
 
-            # Make sure we have enough data before we run any filters
-            assert self.accumulated_raw.shape[0] >= self.reuse_size + self.batch_size
+            except Exception as ex:
+                # Anything else that could go wrong
+                print(repr(ex))
 
+
+    # Accumulates and analyzes the given batch of raw lines from the stream, returning the newly processed data
+    # (or None, if not recording). Without a GUI loop or fetching thread, this can be called directly
+    # with data read from the stream.
+    # arrival_time: when the batch was read from the stream (by time.time()), for measuring latency
+    def process_batch(self, raw_data, arrival_time = None):
+        with self.profiler.stage("process_batch"):
+            return self._process_batch(raw_data, arrival_time)
+
+
+    def _process_batch(self, raw_data, arrival_time):
+        with self.profiler.stage("parse"):
+            samples, n_corrupt = parse_bytes(raw_data, self.raw_columns)
+
+        if arrival_time is not None and samples.shape[0] > 0:
+            # The sensor's clock differs from ours by at most this much (plus the quickest a batch has ever arrived).
+            # If its clock went backwards (ie. it restarted, or simulated data looped), even partway through the batch,
+            # start the estimate over (from the batch's last sample, which is after the jump)
+            times = samples[:, TIME_INDEX]
+
+            if times[0] < self.last_sample_time or np.any(np.diff(times) < 0):
+                self.clock_offset = float("inf")
+
+            self.clock_offset = min(self.clock_offset, arrival_time - samples[-1, TIME_INDEX])
+            self.last_sample_time = samples[-1, TIME_INDEX]
+
+        if n_corrupt:
+            self.corrupt_lines += n_corrupt
+            log_message(2, f"Threw out {n_corrupt} corrupt lines ({self.corrupt_lines} so far). This is likely because you are running on serial mode and read the data mid-line, and is probably nothing to worry about.")
+
+        # Always collect data to keep the queue fresh, but throw it out if we don't want it
+        if(self.should_record):
             # The first time we have enough data, we need to integrate the entire set of calibration batches,
             # so we have an initial reference to add to when integrating future data
             if not self.done_calibrating:
-                calibrated_data = self.calculate_position(self.accumulated_raw, integration_correction=False)
-                self._accumulate_processed_data(calibrated_data)
+                self._accumulate_raw_data(samples)
 
+                # Make sure we have enough data before we run any filters
+                assert len(self.accumulated_raw) >= self.reuse_size + self.batch_size
+
+                new_data = self._calculate_position(self.accumulated_raw.array(RAW_COLUMNS), integration_correction=False)
                 self.done_calibrating = True
 
             else:
-                # When integrating/filtering/etc, throw in some old data too... otherwise the batches are disconnected
-                processed_data = self.calculate_position(self.accumulated_raw.tail(self.reuse_size + self.batch_size))
+                # Usually batch_size, unless some lines were corrupt
+                n_new = samples.shape[0]
+
+                if n_new == 0:
+                    # Every line in the batch was corrupt
+                    return None
+
+                if self.mode != "windowed":
+                    # The streaming filters (and the Kalman filter) remember the old data themselves, so only the new batch is needed
+                    new_data = self._calculate_position(samples[:, :len(RAW_COLUMNS)])
 
-                # ...but still only accumulate the new data
-                new_data = processed_data.tail(self.batch_size)
-                self._accumulate_processed_data(new_data)
+                else:
+                    # When integrating/filtering/etc, throw in some old data too... otherwise the batches are disconnected
+                    reused = self.accumulated_raw.array(RAW_COLUMNS, self.reuse_size)
+                    processed_data = self._calculate_position(np.concatenate((reused, samples[:, :len(RAW_COLUMNS)])))
 
+                    # ...but still only accumulate the new data
+                    new_data = processed_data[-n_new:]
 
-    # Clear out plots and accumulated data
+                # Only once the batch has been processed, so that the raw rows stay in step with the processed rows
+                # (the export pairs them up by position) even if processing fails
+                self._accumulate_raw_data(samples)
+
+            self._accumulate_processed_data(new_data)
+            self.last_processed_time = new_data[-1, PROCESSED_TIME]
+
+            return processed_frame(new_data)
+
+
+    # Clear out plots and accumulated data (including the session on disk, if it's being recorded)
     def reset_recording(self):
+        # Wait for the processing thread to finish its batch, and mark its results from before now as stale
+        with self.lock:
+            self.generation += 1
+            self._clear_accumulated_data()
+
+
+    def _clear_accumulated_data(self):
         self.should_record = False
         self.done_calibrating = False
+        self.last_processed_time = None
+        self.latency = None
+        self.max_latency = 0.0
+
+        if self.session_path is not None:
+            if self.recorder is not None:
+                self.recorder.close()
+
+            self.recorder = recordings.SessionRecorder(self.session_path, self.raw_columns, PROCESSED_COLUMNS)
+
+        # The algorithm's state (eg. the streaming filters'), set up again from the next calibration
+        self.positioner = positioning.create_positioner(self.mode, self.reuse_size, self.cutoff, self.order, profiler = self.profiler)
+
+        # Live statistics of the bowing, worked out as the data is processed (see bowing_analytics)
+        self.analytics = analytics.BowingAnalytics()
+
+        self._close_accumulated_data()
+
+        raw_dtypes, processed_dtypes = storage_dtypes(self.raw_columns, self.compact), storage_dtypes(PROCESSED_COLUMNS, self.compact)
+
+        if self.spill:
+            # Room for the reuse window and a few batches' worth of backlog (which is processed all at once),
+            # and the processed data the integration correction and plots look back on
+            self.accumulated_raw = SpillingColumnBuffer(self.raw_columns, 4 * (self.reuse_size + self.batch_size), raw_dtypes, config.SPILL_DIRECTORY)
+            self.accumulated_processed = SpillingColumnBuffer(PROCESSED_COLUMNS, max(4 * self.reuse_size, config.HISTORY), processed_dtypes, config.SPILL_DIRECTORY)
 
-        self.accumulated_raw = pd.DataFrame(columns=["time_sec", "ax", "ay", "az", "qw", "qx", "qy", "qz"])
-        self.accumulated_processed = pd.DataFrame(columns=["time_sec", "vx", "vy", "vz", "x", "y", "z", "position", "velocity", "projected_X", "projected_Y"])
+        else:
+            self.accumulated_raw = ColumnBuffer(self.raw_columns, raw_dtypes)
+            self.accumulated_processed = ColumnBuffer(PROCESSED_COLUMNS, processed_dtypes)
+
+
+    def _close_accumulated_data(self):
+        for buffer in (self.accumulated_raw, self.accumulated_processed):
+            if buffer is not None:
+                buffer.close()
+
+
+    # To be called once the newest processed data is on screen (or otherwise used), to measure latency:
+    # the time from the sensor taking its newest sample until now
+    def note_displayed(self):
+        if self.last_processed_time is None or self.clock_offset == float("inf"):
+            return
+
+        self.latency = float(time.time() - (self.last_processed_time + self.clock_offset))
+        self.max_latency = max(self.max_latency, self.latency)
+
+
+    # Live statistics of the bowing since the last reset: the stability of the bow's path and the latest strokes
+    # (see analytics.BowingAnalytics.summary)
+    def bowing_analytics(self):
+        with self.lock:
+            return self.analytics.summary()
+
+
+    # Live measurements of how well processing is keeping up with the sensor
+    # Packet counts are None unless the stream keeps track of lost packets (ie. on WiFi and serial)
+    def metrics(self):
+        sequence = getattr(self.stream, "sequence", None)
+
+        return {
+            "queue_depth":       self.data_queue.qsize(),
+            "queue_size":        self.data_queue.maxsize,
+            "dropped_batches":   self.data_queue.dropped,
+            "coalesced_batches": self.data_queue.coalesced,
+            "corrupt_lines":     self.corrupt_lines,
+            "received_packets":  sequence.received if sequence is not None else None,
+            "dropped_packets":   sequence.dropped if sequence is not None else None,
+            "reordered_packets": sequence.reordered if sequence is not None else None,
+            "duplicate_packets": sequence.duplicates if sequence is not None else None,
+            "latency_sec":       self.latency,
+            "max_latency_sec":   self.max_latency,
+            "published":         self.publisher.sent if self.publisher is not None else 0,
+            "publish_dropped":   self.publisher.dropped if self.publisher is not None else 0,
+            "batch_size":        self.scheduler.batch_size if self.scheduler is not None else self.batch_size,
+            "utilization":       float(self.scheduler.utilization) if self.scheduler is not None and self.scheduler.utilization is not None else None,
+            "batch_resizes":     len(self.scheduler.decisions) if self.scheduler is not None else 0
+        }
+
+
+    # Stops fetching data, and finishes writing the session to disk if it's being recorded
+    def close(self):
+        self.stopped.set()
+        self.data_queue.close() # in case the fetching thread is waiting for room (with the "block" policy)
+
+        if self.stream is not None:
+            self.stream.close()
+
+        if self.recorder is not None:
+            self.recorder.close()
+
+        if self.publisher is not None:
+            self.publisher.close()
+
+        with self.lock:
+            self._close_accumulated_data()
 
 
     # Toggle whether to accumulate and plot data. Either way, the fetching thread runs,
@@ -141,18 +416,26 @@ class Sensor:
     # Add the given data to the accumulated storage.
     # We save this so we have data to reuse when integrating
     def _accumulate_raw_data(self, raw_data):
-        self.accumulated_raw = self.accumulated_raw.append(
-            raw_data[self.accumulated_raw.columns],
-            ignore_index = True
-        )
+        with self.profiler.stage("accumulate"):
+            self.accumulated_raw.append(raw_data)
 
-    # Add the given data to the accumulated storage.
+        if self.recorder is not None:
+            self.recorder.write_raw(raw_data)
+
+    # Add the given data (an array of PROCESSED_COLUMNS) to the accumulated storage.
     # We save this both for plotting and for the integration correction in the analysis
     def _accumulate_processed_data(self, processed_data):
-        self.accumulated_processed = self.accumulated_processed.append(
-            processed_data[self.accumulated_processed.columns],
-            ignore_index = True
-        )
+        with self.profiler.stage("accumulate"):
+            self.accumulated_processed.append(processed_data)
+
+        with self.profiler.stage("analytics"):
+            self.analytics.update(processed_data)
+
+        if self.recorder is not None:
+            self.recorder.write_processed(processed_data)
+
+        if self.publisher is not None:
+            self.publisher.publish(dict(zip(PROCESSED_COLUMNS, processed_data.T)))
 
 
 # Printing, but cooler
@@ -163,28 +446,123 @@ def log_message(error_level, msg):
 
 # An infinite loop to be run in a separate thread, so the sensor's stream is never blocked.
 # Data can be retrieved at will from the given queue.
-def retrieve_new_data(stream, n_lines, data_queue):
+# n_lines: how many lines to read at a time, or a function returning how many to read next
+# profiler: times reading (ie. waiting on the sensor) and queueing (ie. waiting on the queue, if it blocks when full)
+# If the stream keeps track of lost packets (ie. on WiFi), newly lost ones are reported as they're noticed.
+def retrieve_new_data(stream, n_lines, data_queue, profiler = NO_PROFILER):
+    sequence = getattr(stream, "sequence", None)
+    n_dropped = 0
+
     try:
         while True:
-            raw_data = stream.readlines(n_lines)
-            data_queue.put(raw_data)
+            with profiler.stage("fetch_read"):
+                raw_data = stream.readlines(n_lines() if callable(n_lines) else n_lines)
+
+            with profiler.stage("fetch_put"):
+                data_queue.put((time.time(), raw_data))
+
+            if sequence is not None and sequence.dropped > n_dropped:
+                log_message(1, f"Lost {sequence.dropped - n_dropped} packets ({sequence.dropped} of {sequence.received + sequence.dropped} so far, {sequence.reordered} out of order, {sequence.duplicates} duplicated)")
+                n_dropped = sequence.dropped
 
     except:  # the connection was closed, so this thread needs to end
         log_message(2, "Fetching has been halted.")
 
 
-# Converts the raw output from the sensor to a Pandas data frame
-def parse_bytes(raw_data: [bytes]) -> pd.DataFrame:
+# A DataFrame of the given array of PROCESSED_COLUMNS, for the Sensor's callers. It's a copy,
+# since the array is usually a view of the Sensor's output array, which the next batch overwrites
+def processed_frame(processed_data):
+    return pd.DataFrame(processed_data, columns = PROCESSED_COLUMNS, copy = True)
+
+
+# Joins two queued (arrival time, raw data) batches into one, for the "coalesce" queue policy
+def merge_batches(older, newer):
+    (_, older_data), (arrival_time, newer_data) = older, newer
+
+    if isinstance(newer_data, np.ndarray):
+        return arrival_time, np.vstack((older_data, newer_data))
+
+    return arrival_time, older_data + newer_data
+
+
+# Joins two uncollected (generation, processed data) results into one. Results from before a reset are dropped,
+# and only the latest config.HISTORY rows are kept, so merging costs at most that much however long they go uncollected
+def merge_results(older, newer):
+    (older_generation, older_data), (generation, newer_data) = older, newer
+
+    if older_generation != generation:
+        return newer
+
+    if len(newer_data) >= config.HISTORY:
+        return generation, newer_data.tail(config.HISTORY).reset_index(drop = True)
+
+    return generation, pd.concat((older_data.tail(config.HISTORY - len(newer_data)), newer_data), ignore_index = True)
+
+
+# The type to store each column as: double precision, or if compact, single precision for all but the time.
+# (As a single, the time would only be accurate to the millisecond a few hours in, and keep getting worse.)
+# Single precision halves the memory used, and is plenty for what the sensor measures.
+def storage_dtypes(columns, compact):
+    if not compact:
+        return "double"
+
+    return { col: "double" if col == "time_sec" else "single" for col in columns }
+
+
+# Converts the raw output from the sensor to an array holding the given columns of config.COLUMNS
+# (by default, just those the positioning algorithm needs), one row per valid line.
+# Returns the array along with the number of corrupt lines that were thrown out.
+# Lines are only screened individually; the numbers in all of them are parsed in one pass.
+# Rows that are already parsed (eg. replayed from a recording) just have their columns picked out.
+def parse_bytes(raw_data: [bytes], columns = RAW_COLUMNS) -> (np.ndarray, int):
+    if isinstance(raw_data, np.ndarray):
+        return raw_data[:, [config.COLUMNS.index(col) for col in columns]], 0
+
+    n_fields = len(config.COLUMNS)
+
+    # Keep only lines with the mugicdata prefix, but lose that prefix.
+    # A line read mid-broadcast (likely on serial mode) has the wrong number of fields, and is corrupt
+    data_lines = [line for line in (line.strip() for line in raw_data) if line.startswith(DATA_PREFIX)]
+    valid_lines = [line[len(DATA_PREFIX):] for line in data_lines if line.count(b" ") == n_fields]
+    n_corrupt = len(data_lines) - len(valid_lines)
+
+    try:
+        with warnings.catch_warnings():
+            # Older NumPy versions warn (rather than raise) and stop parsing when a line isn't numeric
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(b" ".join(valid_lines), sep = " ")
+
+    except ValueError:
+        values = np.empty(0)
+
+    if values.size == len(valid_lines) * n_fields:
+        values = values.reshape(-1, n_fields)
+
+    else:
+        # Some line had garbage in it, so fall back to parsing line by line to find out which
+        values, n_garbled = _parse_lines_individually(valid_lines, n_fields)
+        n_corrupt += n_garbled
+
+    return values[:, [config.COLUMNS.index(col) for col in columns]], n_corrupt
+
+
+# The slow path of parse_bytes, returning the parsed lines and how many couldn't be parsed
+def _parse_lines_individually(lines, n_fields):
     rows = []
 
-    for line in raw_data:
+    for line in lines:
+        fields = line.split()
+
+        # eg. two spaces in a row pass the count in parse_bytes, but come out a field short
+        if len(fields) != n_fields:
+            continue
+
         try:
-            line = line.decode("utf-8").strip()
+            rows.append(np.array(fields, dtype = "double"))
+
+        except ValueError:
+            pass
 
-            if line.startswith("mugicdata"): # Keep only lines with mugicdata prefix
-                rows.append(line.split(' ')[1:])  # but lose that prefix
-        
-        except:
-            print("A line of data was corrupt. This is likely because you are running on serial mode and read the data mid-line. This line will be thrown out and is probably nothing to worry about.")
+    values = np.array(rows).reshape(-1, n_fields)
 
-    return pd.DataFrame(rows, dtype="double", columns = config.COLUMNS)
\ No newline at end of file
+    return values, len(lines) - len(rows)
@@ -0,0 +1,194 @@
+# Live measures of the bowing, kept up to date from the processed data as it comes in, so they can be shown
+# (eg. to a teacher, during a lesson) without going back over the session:
+#   stability: the spread of the projected points (projected_X, projected_Y) over the recent samples, as their
+#              total variance and the ellipse they fill (one standard deviation along each principal axis).
+#              The steadier the bow's path, the smaller the ellipse.
+#   strokes:   the bowing split into strokes at each change of direction (when the velocity PC changes sign),
+#              with each stroke's duration, length (along the position PC), mean speed, how many times it crossed
+#              the middle of the bowing (the position PC's zero), and how much the projected points spread over it.
+# Each batch only costs as much as its new samples: the statistics are running sums, and the strokes' averages are
+# kept as totals over the latest strokes, so nothing is ever recomputed over the history.
+
+import collections, math
+import numpy as np
+
+import config, tools
+from positioning import POSITION_PC, PROCESSED_TIME, PROJECTED, VELOCITY_PC
+
+
+# The per-stroke metrics that are averaged over the latest strokes
+STROKE_METRICS = ["duration_sec", "length", "speed", "center_crossings", "spread"]
+
+
+class BowingAnalytics:
+    # window: roughly how many of the latest samples the stability statistics (and the bow speed the hysteresis
+    # is relative to) are taken over. Older samples are exponentially forgotten.
+    # hysteresis: how far past zero, as a fraction of the recent RMS bow speed, the velocity PC has to go to count as
+    # a change of direction, so the jitter of a bow at rest isn't taken for lots of tiny strokes
+    # max_strokes: how many of the latest strokes to keep (and average the metrics over)
+    def __init__(self, window = config.STABILITY_WINDOW, hysteresis = config.STROKE_HYSTERESIS, max_strokes = 100):
+        self.hysteresis = hysteresis
+        self.forget = 1 - 1 / window
+
+        self.projection_PCA = tools.RunningPCA(n_dims = 2, window = window)
+        self.n_samples = 0
+
+        # The exponentially weighted mean square of the velocity PC, ie. of the bow's speed
+        self.speed_weight = 0.0
+        self.mean_square_speed = 0.0
+
+        self.last_time = -math.inf
+        self.direction = 0     # the bow's current direction (1 or -1), or 0 before it has moved
+        self.position_sign = 0 # which side of the middle of the bowing the bow was last on
+        self.stroke = None     # running sums for the stroke in progress (None until the first change of direction)
+
+        self.n_strokes = 0
+        self.strokes = collections.deque(maxlen = max_strokes) # dicts of the latest strokes' metrics, oldest first
+        self.totals = dict.fromkeys(STROKE_METRICS, 0.0)       # the sums of those metrics, for their averages
+
+    # processed: (n x 11) array of newly processed rows (in PROCESSED_COLUMNS)
+    def update(self, processed):
+        if processed.shape[0] == 0:
+            return
+
+        self.projection_PCA.update(processed[:, PROJECTED])
+        self.n_samples += processed.shape[0]
+
+        # If the sensor's clock went backwards (ie. it restarted, or simulated data looped), the stroke in progress
+        # can't be timed, so it's dropped, and strokes are counted again from the bow's next turn
+        time_sec = processed[:, PROCESSED_TIME]
+        restarts = np.flatnonzero(np.diff(np.concatenate(([self.last_time], time_sec))) < 0)
+        self.last_time = time_sec[-1]
+
+        for start, end in zip(np.concatenate(([0], restarts)), np.concatenate((restarts, [len(time_sec)]))):
+            if start in restarts:
+                self.direction = 0
+                self.stroke = None
+
+            rows = processed[start:end]
+            self._update_strokes(rows[:, PROCESSED_TIME], rows[:, POSITION_PC], rows[:, VELOCITY_PC], rows[:, PROJECTED])
+
+    # The statistics so far, as a dict (with None for any that can't be worked out yet)
+    def summary(self):
+        summary = { "samples": self.n_samples, "center": None, "variance": None, "ellipse": None }
+
+        if self.n_samples > 1:
+            rotation, covariance = self.projection_PCA.rotation, self.projection_PCA.covariance
+            variances = np.maximum(0, np.diag(rotation.T @ covariance @ rotation)) # along the principal axes
+            angle = math.degrees(math.atan2(rotation[1, 0], rotation[0, 0]))
+
+            summary["center"] = self.projection_PCA.mean.tolist()
+            summary["variance"] = float(np.trace(covariance))
+            summary["ellipse"] = {
+                "major":     float(np.sqrt(variances[0])),
+                "minor":     float(np.sqrt(variances[1])),
+                "angle_deg": (angle + 90) % 180 - 90 # an axis points both ways, so keep it within +-90 degrees
+            }
+
+        summary["strokes"] = self.n_strokes
+        summary["last_stroke"] = dict(self.strokes[-1]) if self.strokes else None
+
+        n = len(self.strokes)
+        summary["strokes_per_min"] = 60 * n / self.totals["duration_sec"] if n and self.totals["duration_sec"] > 0 else None
+        summary.update({ f"mean_{metric}": self.totals[metric] / n if n else None for metric in STROKE_METRICS })
+
+        return summary
+
+    # A table of the summary, for printing
+    def report(self):
+        summary = self.summary()
+        lines = [f"{'samples':<24}{summary['samples']}", f"{'strokes':<24}{summary['strokes']}"]
+
+        if summary["ellipse"] is not None:
+            lines.append(f"{'variance':<24}{summary['variance']:.6g}")
+            lines.append(f"{'ellipse':<24}{summary['ellipse']['major']:.4g} x {summary['ellipse']['minor']:.4g} at {summary['ellipse']['angle_deg']:.1f} deg")
+
+        for key in ["strokes_per_min"] + [f"mean_{metric}" for metric in STROKE_METRICS]:
+            if summary[key] is not None:
+                lines.append(f"{key:<24}{summary[key]:.4g}")
+
+        return "\n".join(lines)
+
+    def _update_strokes(self, time_sec, position, velocity, projected):
+        n = velocity.shape[0]
+
+        if n == 0:
+            return
+
+        weights = self.forget ** np.arange(n - 1, -1, -1)
+        self.speed_weight = self.speed_weight * self.forget ** n + weights.sum()
+        self.mean_square_speed += (np.dot(weights, velocity ** 2) - weights.sum() * self.mean_square_speed) / self.speed_weight
+        threshold = self.hysteresis * math.sqrt(self.mean_square_speed)
+
+        # The direction at each sample: that of the velocity PC the last time it went past the threshold
+        beyond = np.where(velocity > threshold, 1, np.where(velocity < -threshold, -1, 0))
+        last_beyond = np.maximum.accumulate(np.where(beyond != 0, np.arange(n), -1))
+        direction = np.where(last_beyond >= 0, beyond[last_beyond], self.direction)
+
+        start = 0
+
+        for end in np.flatnonzero(direction != np.concatenate(([self.direction], direction[:-1]))):
+            self._extend_stroke(position[start:end], velocity[start:end], projected[start:end])
+
+            if self.stroke is not None:
+                self._finish_stroke(time_sec[end])
+
+            # The bow's first movement may have started before recording did, so strokes are only counted from its first turn
+            if self.direction != 0:
+                self.stroke = { "start_sec": float(time_sec[end]), "direction": int(direction[end]), "n": 0, "min": math.inf, "max": -math.inf,
+                                "speed_sum": 0.0, "center_crossings": 0, "projected_sum": np.zeros(2), "square_sum": 0.0 }
+
+            self.direction = direction[end]
+            start = end
+
+        self._extend_stroke(position[start:], velocity[start:], projected[start:])
+
+    # Adds the samples to the stroke in progress
+    def _extend_stroke(self, position, velocity, projected):
+        if len(position) == 0:
+            return
+
+        signs = np.sign(np.concatenate(([self.position_sign], position)))
+        self.position_sign = signs[-1]
+
+        if self.stroke is None:
+            return
+
+        stroke = self.stroke
+        stroke["n"] += len(position)
+        stroke["min"] = min(stroke["min"], float(position.min()))
+        stroke["max"] = max(stroke["max"], float(position.max()))
+        stroke["speed_sum"] += float(np.abs(velocity).sum())
+        stroke["center_crossings"] += int(np.count_nonzero(signs[1:] * signs[:-1] < 0))
+        stroke["projected_sum"] += projected.sum(axis = 0)
+        stroke["square_sum"] += float(np.sum(projected ** 2))
+
+    # Records the stroke in progress, which ended at the given time
+    def _finish_stroke(self, end_sec):
+        stroke = self.stroke
+
+        if stroke["n"] == 0:
+            return
+
+        mean_projected = stroke["projected_sum"] / stroke["n"]
+
+        metrics = {
+            "start_sec":        stroke["start_sec"],
+            "direction":        stroke["direction"],
+            "duration_sec":     float(end_sec - stroke["start_sec"]),
+            "length":           stroke["max"] - stroke["min"],
+            "speed":            stroke["speed_sum"] / stroke["n"], # the mean over the stroke
+            "center_crossings": stroke["center_crossings"],
+            # the RMS distance of the projected points from their mean over the stroke
+            "spread":           math.sqrt(max(0.0, stroke["square_sum"] / stroke["n"] - float(np.sum(mean_projected ** 2))))
+        }
+
+        if len(self.strokes) == self.strokes.maxlen:
+            for metric in STROKE_METRICS:
+                self.totals[metric] -= self.strokes[0][metric]
+
+        self.strokes.append(metrics)
+        self.n_strokes += 1
+
+        for metric in STROKE_METRICS:
+            self.totals[metric] += metrics[metric]
@@ -4,11 +4,12 @@ from PySide2 import QtCore, QtWidgets, QtGui
 import sys, traceback
 
 from ConfigWindow import ConfigWindow
-from MainWindow import MainWindow
 from ErrorWindow import ErrorWindow
-from Sensor import Sensor
 import config
 
+# The positioning pipeline (pandas, scipy) and the plots (pyqtgraph) are only imported once the setup is chosen,
+# so that the config dialog shows up right away. Run src/import_report.py to see what each import costs.
+
 
 if __name__ == "__main__":
     try:
@@ -22,6 +23,9 @@ if __name__ == "__main__":
 
             assert batch_size < config.HISTORY
 
+            from MainWindow import MainWindow
+            from Sensor import Sensor
+
             sensor = Sensor(stream, batch_size, reuse_size)
 
             main_window = MainWindow(sensor)
@@ -0,0 +1,197 @@
+# Benchmarks the positioning pipeline headlessly, over recorded data, for a grid of batch and reuse sizes.
+#   python3 src/benchmark.py [--input recording] [--batch-sizes 10 20 50] [--reuse-multiples 5 10 20] [--output results.json]
+# For each configuration, each stage of the pipeline is timed per call (latency percentiles and throughput),
+# the whole pipeline's peak memory is measured, and the results are stored as JSON so versions can be compared.
+# The recording is repeated (shifted in time) until it lasts --duration seconds.
+
+import argparse, json, pickle, platform, time, tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from buffers import ColumnBuffer
+from recordings import Recording
+from Sensor import Sensor, MODES, RAW_COLUMNS, DATA_PREFIX, parse_bytes
+from streams import SimulatedStream
+import config, tools
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the MUGIC positioning pipeline over recorded data.")
+    parser.add_argument("--input", default = None, help = "a recording (.mrec or .pckl); by default, the bundled simulated data")
+    parser.add_argument("--batch-sizes", type = int, nargs = "+", default = [10, 20, 50])
+    parser.add_argument("--reuse-multiples", type = int, nargs = "+", default = [5, 10, 20], help = "reuse sizes, as multiples of the batch size")
+    parser.add_argument("--modes", nargs = "+", choices = MODES, default = list(MODES))
+    parser.add_argument("--duration", type = float, default = 30, help = "seconds of sensor data to run each configuration over")
+    parser.add_argument("--output", default = None, help = "the JSON file to store results in")
+    args = parser.parse_args()
+
+    lines, rows = load_data(args.input, args.duration)
+    samp_rate = rows.shape[0] / (rows[-1, config.COLUMNS.index("time_sec")] - rows[0, config.COLUMNS.index("time_sec")])
+
+    results = []
+
+    for mode in args.modes:
+        for batch_size in args.batch_sizes:
+            for multiple in args.reuse_multiples:
+                result = benchmark_configuration(lines, rows, batch_size, batch_size * multiple, mode, samp_rate)
+                results.append(result)
+
+                print(
+                    f"{mode:>9}  batch {batch_size:>4}  reuse {batch_size * multiple:>5}  "
+                    f"p50 {result['stages']['batch_total']['p50_ms']:8.2f} ms  "
+                    f"p99 {result['stages']['batch_total']['p99_ms']:8.2f} ms  "
+                    f"budget {result['batch_interval_ms']:7.1f} ms  "
+                    f"peak {result['peak_memory_mb']:7.1f} MB  "
+                    f"{'keeps up' if result['keeps_up'] else 'FALLS BEHIND'}"
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "timestamp":    datetime.now().isoformat(),
+                    "python":       platform.python_version(),
+                    "numpy":        np.__version__,
+                    "pandas":       pd.__version__,
+                    "platform":     platform.platform(),
+                    "input":        args.input or "simulated",
+                    "duration_sec": args.duration,
+                    "sample_rate":  float(samp_rate)
+                },
+                "results": results
+            }, f, indent = 2)
+
+
+# Returns the raw lines of the recording, and its rows (in config.COLUMNS order) repeated to last duration seconds
+def load_data(path, duration):
+    if path is not None and path.endswith(".mrec"):
+        recording = Recording(path)
+        rows = np.column_stack([recording.column(col) for col in config.COLUMNS])
+        lines = [DATA_PREFIX + " ".join(map(repr, row)).encode() for row in rows.tolist()]
+
+    else:
+        if path is None:
+            lines = SimulatedStream(delay_ms = 0).data
+
+        else:
+            with open(path, "rb") as f:
+                lines = pickle.load(f)
+
+        rows, _ = parse_bytes(lines, config.COLUMNS)
+
+    times = rows[:, config.COLUMNS.index("time_sec")]
+    period = (times[-1] - times[0]) * rows.shape[0] / (rows.shape[0] - 1)
+    n_repeats = int(np.ceil(duration / period))
+
+    repeated = np.tile(rows, (n_repeats, 1))
+    repeated[:, config.COLUMNS.index("time_sec")] += np.repeat(np.arange(n_repeats) * period, rows.shape[0])
+
+    return lines, repeated
+
+
+def benchmark_configuration(lines, rows, batch_size, reuse_size, mode, samp_rate):
+    n_batches = rows.shape[0] // batch_size
+    batches = [rows[i * batch_size : (i + 1) * batch_size] for i in range(n_batches)]
+    line_batches = [lines[i : i + batch_size] for i in range(0, len(lines) - batch_size + 1, batch_size)]
+
+    window = pd.DataFrame(rows[:reuse_size + batch_size][:, [config.COLUMNS.index(col) for col in RAW_COLUMNS]], columns = RAW_COLUMNS)
+    window_acceleration = window[["ax", "ay", "az"]].to_numpy()
+    window_quaternions = window[["qw", "qx", "qy", "qz"]].to_numpy()
+
+    stages = {}
+
+    stages["parse_bytes"] = summarize(time_calls(parse_bytes, [(batch,) for batch in line_batches]), batch_size)
+
+    buffer = ColumnBuffer(RAW_COLUMNS)
+    stages["accumulate"] = summarize(time_calls(buffer.append, [(parse_bytes(batch)[0],) for batch in batches]), batch_size)
+
+    stages["rotate_by_quaternions"] = summarize(
+        time_calls(tools.rotate_by_quaternions, [(window_quaternions, window_acceleration)] * 100), batch_size
+    )
+    stages["filter_and_integrate"] = summarize(
+        time_calls(tools.filter_and_integrate, [(window.ax, window.time_sec)] * 100), batch_size
+    )
+    stages["PCA"] = summarize(time_calls(tools.PCA, [(window_acceleration,)] * 100), batch_size)
+
+    # The whole pipeline, batch by batch (the parsing of a batch is timed above, and added on)
+    sensor = Sensor(None, batch_size, reuse_size, mode, fetch = False, session_path = None)
+    sensor.toggle_recording()
+
+    pipeline_seconds = time_calls(lambda batch: process_quietly(sensor, batch), [(batch,) for batch in batches])
+    calibration_batches = int(np.ceil((reuse_size + batch_size) / batch_size))
+    pipeline_seconds = pipeline_seconds[calibration_batches:] # leave out the calibration, which only happens once
+
+    sensor.close()
+
+    stages["process_batch"] = summarize(pipeline_seconds, batch_size)
+    stages["batch_total"] = summarize(pipeline_seconds + np.median(time_calls(parse_bytes, [(batch,) for batch in line_batches])), batch_size)
+
+    batch_interval_ms = 1000 * batch_size / samp_rate
+
+    return {
+        "mode":              mode,
+        "batch_size":        batch_size,
+        "reuse_size":        reuse_size,
+        "batch_interval_ms": float(batch_interval_ms),
+        "keeps_up":          bool(stages["batch_total"]["p99_ms"] < batch_interval_ms),
+        "peak_memory_mb":    peak_memory(batches, batch_size, reuse_size, mode) / 2 ** 20,
+        "stages":            stages
+    }
+
+
+def process_quietly(sensor, batch):
+    try:
+        sensor.process_batch(batch)
+
+    except AssertionError:
+        pass # still calibrating
+
+
+# The time each call of fn took, for each tuple of arguments in args_list
+def time_calls(fn, args_list):
+    seconds = np.empty(len(args_list))
+
+    for i, args in enumerate(args_list):
+        start = time.perf_counter()
+        fn(*args)
+        seconds[i] = time.perf_counter() - start
+
+    return seconds
+
+
+def summarize(seconds, samples_per_call):
+    milliseconds = 1000 * np.asarray(seconds)
+
+    return {
+        "calls":           len(milliseconds),
+        "mean_ms":         float(milliseconds.mean()),
+        "p50_ms":          float(np.percentile(milliseconds, 50)),
+        "p90_ms":          float(np.percentile(milliseconds, 90)),
+        "p99_ms":          float(np.percentile(milliseconds, 99)),
+        "max_ms":          float(milliseconds.max()),
+        "samples_per_sec": float(samples_per_call * len(milliseconds) / np.sum(seconds))
+    }
+
+
+# The peak memory allocated while running the whole pipeline, in bytes.
+# This is a separate run, since tracing allocations slows everything down.
+def peak_memory(batches, batch_size, reuse_size, mode):
+    tracemalloc.start()
+
+    sensor = Sensor(None, batch_size, reuse_size, mode, fetch = False, session_path = None)
+    sensor.toggle_recording()
+
+    for batch in batches:
+        process_quietly(sensor, batch)
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sensor.close()
+
+    return peak
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import collections, os, tempfile
+import numpy as np
+import pandas as pd
+
+from recordings import Recording, RecordingWriter
+
+
+# Growable storage for a table of numeric columns, backed by one NumPy array per column.
+# Appending a batch is amortized O(batch): when the storage fills up, it doubles in size,
+# so the data is copied only O(log n) times over a session (rather than on every append,
+# as DataFrame.append does). Memory use is at most twice the number of rows stored.
+# Columns are handed out as views into the storage, so reading the latest rows is also cheap.
+class ColumnBuffer:
+    def __init__(self, columns, dtype = "double", capacity = 1024):
+        self.columns = list(columns)
+        self.dtypes = dtype if isinstance(dtype, dict) else { col: dtype for col in self.columns }
+
+        self._capacity = max(1, capacity)
+        self._size = 0
+        self._data = { col: np.empty(self._capacity, dtype = self.dtypes[col]) for col in self.columns }
+
+
+    def __len__(self):
+        return self._size
+
+
+    # Name-based access to a whole column, ie. buffer["time_sec"]
+    def __getitem__(self, name):
+        return self.column(name)
+
+
+    # Add rows to the end of the buffer.
+    # data: a DataFrame or dict of equal-length columns (containing at least our columns),
+    #       or a 2D array whose columns are in the same order as ours
+    def append(self, data):
+        if isinstance(data, np.ndarray):
+            n_rows = data.shape[0]
+            new_columns = { col: data[:, i] for i, col in enumerate(self.columns) }
+
+        else:
+            n_rows = len(data[self.columns[0]])
+            new_columns = { col: data[col] for col in self.columns }
+
+        if n_rows == 0:
+            return
+
+        self._reserve(self._size + n_rows)
+
+        for col, values in new_columns.items():
+            self._data[col][self._size : self._size + n_rows] = values
+
+        self._size += n_rows
+
+
+    # A view of the last n values of a column (or all of it, if n is None).
+    # Views are invalidated by the next append, so copy them if they need to be kept.
+    def column(self, name, n = None):
+        return self._data[name][self._start(n) : self._size]
+
+
+    # An (n x len(columns)) array holding the last n rows of the given columns
+    def array(self, columns = None, n = None):
+        columns = self.columns if columns is None else columns
+
+        return np.column_stack([self.column(col, n) for col in columns])
+
+
+    # A DataFrame holding the last n rows (indexed from 0)
+    def tail(self, n):
+        return pd.DataFrame({ col: self.column(col, n) for col in self.columns }, columns = self.columns)
+
+
+    # A DataFrame holding every row in the buffer
+    def to_frame(self):
+        return self.tail(None)
+
+
+    # An (end - start) x len(columns) array of the rows in that range, eg. to export them a chunk at a time
+    def read(self, start, end):
+        end = min(end, self._size) # the storage past the last row is uninitialized
+
+        return np.column_stack([self._data[col][start:end] for col in self.columns])
+
+
+    def clear(self):
+        self._size = 0
+
+
+    def close(self):
+        pass
+
+
+    def _start(self, n):
+        return 0 if n is None else max(0, self._size - n)
+
+
+    # Make sure there is room for at least n_rows, doubling the storage as needed
+    def _reserve(self, n_rows):
+        if n_rows <= self._capacity:
+            return
+
+        while self._capacity < n_rows:
+            self._capacity *= 2
+
+        for col, values in self._data.items():
+            grown = np.empty(self._capacity, dtype = values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._data[col] = grown
+
+
+# A ColumnBuffer that only keeps its latest rows in memory (at least `window` of them, and at most twice that),
+# moving older rows out to a temporary recording file as it goes, so its memory use stays the same however long
+# a session runs. Each row is moved once, so appending stays amortized O(batch). Reading rows that are still
+# in memory is as cheap as ever, and reading further back (eg. to export) transparently reads the file too.
+class SpillingColumnBuffer(ColumnBuffer):
+    # directory: where to keep the file (by default, the system's temporary directory). It's deleted on close.
+    def __init__(self, columns, window, dtype = "double", directory = None):
+        super().__init__(columns, dtype, capacity = 2 * window)
+        self.window = window
+
+        handle, self.path = tempfile.mkstemp(suffix = ".mrec", prefix = "mugic-", dir = directory)
+        os.close(handle)
+
+        self._writer = RecordingWriter(self.path, self.columns) # in double precision, whatever the columns' dtype
+        self._n_spilled = 0
+
+
+    def __len__(self):
+        return self._n_spilled + self._size
+
+
+    def append(self, data):
+        super().append(data)
+
+        if self._size > 2 * self.window:
+            self._spill(self._size - self.window)
+
+
+    def column(self, name, n = None):
+        n = len(self) if n is None else min(n, len(self))
+
+        if n <= self._size:
+            return super().column(name, n)
+
+        return np.concatenate((self._read_spilled(self._n_spilled - (n - self._size), self._n_spilled)[:, self.columns.index(name)],
+                               super().column(name)))
+
+
+    def read(self, start, end):
+        end = min(end, len(self))
+        in_memory = super().read(max(0, start - self._n_spilled), max(0, end - self._n_spilled))
+
+        if start >= self._n_spilled:
+            return in_memory
+
+        return np.vstack((self._read_spilled(start, min(end, self._n_spilled)), in_memory))
+
+
+    # The rows so far, as a table that later appends don't change (with columns, a length, and read(start, end),
+    # as recordings.tables_to_csv takes), so it can be read without holding up whatever appends to the buffer.
+    # Only the rows in memory are copied; those in the file are mapped, so it's good until the buffer is cleared.
+    def snapshot(self):
+        self._writer.flush()
+
+        return _Snapshot(self.columns, Recording(self.path).rows[:self._n_spilled], super().read(0, self._size).copy())
+
+
+    def clear(self):
+        super().clear()
+
+        self._writer.close()
+        self._writer = RecordingWriter(self.path, self.columns)
+        self._n_spilled = 0
+
+
+    def close(self):
+        self._writer.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+    # Move the oldest n rows in memory to the file
+    def _spill(self, n):
+        self._writer.append(super().read(0, n))
+
+        for values in self._data.values():
+            values[:self._size - n] = values[n:self._size]
+
+        self._size -= n
+        self._n_spilled += n
+
+
+    def _read_spilled(self, start, end):
+        self._writer.flush()
+
+        return np.array(Recording(self.path).rows[start:end]) # copied, so the file isn't held open
+
+
+# The rows of a SpillingColumnBuffer at the time of its snapshot: those spilled to its file, then those in memory
+class _Snapshot:
+    def __init__(self, columns, spilled, in_memory):
+        self.columns = columns
+        self._spilled = spilled
+        self._in_memory = in_memory
+
+    def __len__(self):
+        return len(self._spilled) + len(self._in_memory)
+
+    def read(self, start, end):
+        n_spilled = len(self._spilled)
+        in_memory = self._in_memory[max(0, start - n_spilled):max(0, end - n_spilled)]
+
+        if start >= n_spilled:
+            return in_memory
+
+        return np.vstack((self._spilled[start:min(end, n_spilled)], in_memory))
+
+
+# The latest `size` values of a series, in a fixed block of memory. Each value is stored twice, `size` apart,
+# so the latest values are always one contiguous view (as plotting needs), with nothing shifted or copied.
+class WindowBuffer:
+    def __init__(self, size, dtype = "double"):
+        self.size = size
+        self._data = np.zeros(2 * size, dtype = dtype)
+        self._next = 0  # where the next value goes, in the lower copy
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, values):
+        values = np.asarray(values)[-self.size:]
+        positions = (self._next + np.arange(len(values))) % self.size
+
+        self._data[positions] = values
+        self._data[positions + self.size] = values
+
+        self._next = (self._next + len(values)) % self.size
+        self._count = min(self.size, self._count + len(values))
+
+    # A view of the latest values, oldest first. It is only valid until the next push.
+    def values(self):
+        end = self._next + self.size
+
+        return self._data[end - self._count : end]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+
+# The minimum and maximum of the latest `window` values of a series, updated in amortized O(1) per value.
+# Each is kept at the front of a monotonic deque of (index, value) pairs, from which values are dropped
+# once they leave the window, or once a newer value makes it impossible for them to be the extreme.
+class RollingExtrema:
+    def __init__(self, window):
+        self.window = window
+        self._count = 0
+        self._minima = collections.deque() # values increase from front to back
+        self._maxima = collections.deque() # values decrease from front to back
+
+    def push(self, values):
+        for value in np.asarray(values).tolist():
+            index = self._count
+            self._count += 1
+
+            # Expire what has left the window first, so a run of NaNs pushes the old extremes out too
+            while self._minima and self._minima[0][0] <= index - self.window:
+                self._minima.popleft()
+
+            while self._maxima and self._maxima[0][0] <= index - self.window:
+                self._maxima.popleft()
+
+            if value != value: # NaN takes up a place in the window, but can't be an extreme
+                continue
+
+            while self._minima and self._minima[-1][1] >= value:
+                self._minima.pop()
+
+            while self._maxima and self._maxima[-1][1] <= value:
+                self._maxima.pop()
+
+            self._minima.append((index, value))
+            self._maxima.append((index, value))
+
+    # None until a value has been pushed
+    @property
+    def min(self):
+        return self._minima[0][1] if self._minima else None
+
+    @property
+    def max(self):
+        return self._maxima[0][1] if self._maxima else None
+
+    def clear(self):
+        self._count = 0
+        self._minima.clear()
+        self._maxima.clear()
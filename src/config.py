@@ -3,6 +3,24 @@ BATCH_SIZE  = 20                 # number of observations to fetch from sensor b
 REUSE_SIZE  = 10 * BATCH_SIZE    # number of old samples to include when processing new data, for connectedness & boosted filter performance
 HISTORY     = 50 * BATCH_SIZE    # number of observations to display
 
+POSITIONING_MODE = "windowed"    # "windowed" re-filters the reuse window with zero-phase filtfilt each batch; "streaming" keeps causal filter state, so each batch only costs its new samples; "kalman" updates a Kalman filter per sample, so batches can be as small as 1
+FILTER_CUTOFF_HZ = 0.36          # cutoff of the high pass filters that remove drift before each integration (windowed and streaming modes)
+FILTER_ORDER = 5                 # order of those (Butterworth) filters
+QUEUE_SIZE  = 10                 # number of fetched batches that can wait to be processed before QUEUE_POLICY kicks in
+QUEUE_POLICY = "drop_oldest"     # when the queue is full: "drop_oldest" keeps latency bounded, "coalesce" merges batches so none are lost, "block" stalls fetching
+ADAPTIVE_BATCHING = True         # resize fetched batches (from BATCH_SIZE) to how fast they're processed, and process queued-up batches together
+PROCESS_IN_BACKGROUND = True     # run the positioning algorithm on its own thread, so a slow batch doesn't freeze the GUI
+SESSION_PATH = None              # if set (eg. "session"), data is also streamed to session.raw.mrec and session.processed.mrec as it's recorded, and exported from there
+PUBLISH_TO  = []                 # subscribers to send processed data to live, as OSC (eg. ["udp:127.0.0.1:9000", "unix:/tmp/mugic.sock"])
+COMPACT_STORAGE = False          # store accumulated data in single precision (time excepted), halving the memory a long session takes
+OPTIONAL_COLUMNS = []            # other COLUMNS to keep and export along with the ones positioning needs (eg. ["BatteryPercent", "SequenceNum"])
+SPILL_TO_DISK = True             # keep only recent data in memory, moving the rest out to temporary files (still exported), so memory use stays constant
+SPILL_DIRECTORY = None           # where those files go (None: the system's temporary directory)
+ROTATION_DTYPE = "double"        # precision of the quaternion rotation ("single" is faster on large reuse windows, "double" is exact)
+STABILITY_WINDOW = HISTORY       # number of recent samples the live bowing statistics are taken over (see Run > Show bowing analytics); older ones are gradually forgotten
+STROKE_HYSTERESIS = 0.25         # how far past zero (as a fraction of the recent RMS bow speed) the velocity PC has to go to count as a change of bow direction
+PROFILE = False                  # time each stage of processing (see Run > Show profile); cheap enough to leave on during a show
+
 DEBUG_LEVEL = 1                  # flag to print messages to console (0: off, 1: errors only, 2: all)
 
 # Configurations set by the MUGIC firmware
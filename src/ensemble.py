@@ -0,0 +1,120 @@
+# Runs several MUGIC sensors at once (eg. one on each hand, or a whole ensemble), each in its own process.
+# Each sensor's positioning algorithm then gets a core to itself, rather than every sensor taking turns
+# under one GIL, and all of their processed batches come back through one queue to be consumed in one place.
+#   python3 src/ensemble.py <output.csv> <input> [<input> ...] [options]
+
+import argparse, multiprocessing, time
+import numpy as np
+import pandas as pd
+
+from Sensor import MODES, PROCESSED_COLUMNS, log_message
+from streams import open_stream
+import config, headless
+
+
+class SensorPool:
+    # descriptions: one stream description per sensor, as for streams.open_stream
+    # (streams can't be handed to another process, so each worker opens its own)
+    def __init__(self, descriptions, batch_size = config.BATCH_SIZE, reuse_size = config.REUSE_SIZE, mode = config.POSITIONING_MODE):
+        self.descriptions = list(descriptions)
+        self.results = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+
+        self.processes = [
+            multiprocessing.Process(
+                target = run_worker,
+                args = (index, description, batch_size, reuse_size, mode, self.results, self.stop_event),
+                daemon = True
+            )
+            for index, description in enumerate(self.descriptions)
+        ]
+
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+
+    # Yields (sensor index, array of newly processed rows in PROCESSED_COLUMNS order) as batches
+    # come in from any sensor, until every sensor's stream has ended
+    def consume(self):
+        n_running = len(self.processes)
+
+        while n_running:
+            index, data = self.results.get()
+
+            if data is None: # that sensor is done
+                n_running -= 1
+
+            else:
+                yield index, data
+
+
+    # Asks the workers to finish up, and ends any that are stuck (eg. waiting on a silent stream)
+    def stop(self, timeout = 1):
+        self.stop_event.set()
+
+        for process in self.processes:
+            process.join(timeout)
+
+            if process.is_alive():
+                process.terminate()
+
+
+# The loop run in each worker process. Always ends by sending None, so the consumer knows it's done.
+def run_worker(index, description, batch_size, reuse_size, mode, results, stop_event):
+    try:
+        sensor = headless.run(
+            open_stream(description), batch_size, reuse_size, mode,
+            on_processed = lambda new_data: results.put((index, new_data[PROCESSED_COLUMNS].to_numpy())),
+            should_stop = stop_event.is_set
+        )
+        sensor.close()
+
+    except Exception as ex:
+        log_message(1, f"Sensor {index} ({description}) stopped: {repr(ex)}")
+
+    finally:
+        results.put((index, None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run the MUGIC positioning algorithm on several sensors at once, one process each.")
+    parser.add_argument("output", help = "the CSV file to export every sensor's processed data to")
+    parser.add_argument("inputs", nargs = "+", help = 'one per sensor: a recording (.mrec or .pckl), "sim", "udp:<ip>:<port>" or "serial:<port>:<baud>"')
+    parser.add_argument("--batch-size", type = int, default = config.BATCH_SIZE)
+    parser.add_argument("--reuse-size", type = int, default = config.REUSE_SIZE)
+    parser.add_argument("--mode", choices = MODES, default = config.POSITIONING_MODE)
+    args = parser.parse_args()
+
+    pool = SensorPool(args.inputs, args.batch_size, args.reuse_size, args.mode)
+    batches = { index: [] for index in range(len(args.inputs)) }
+
+    start_time = time.time()
+    pool.start()
+
+    try:
+        for index, data in pool.consume():
+            batches[index].append(data)
+
+    except KeyboardInterrupt:
+        log_message(2, "Interrupted, exporting what has been processed so far")
+
+    finally:
+        pool.stop()
+
+    elapsed = time.time() - start_time
+    frames = []
+
+    for index, data in batches.items():
+        processed = pd.DataFrame(np.vstack(data) if data else None, columns = PROCESSED_COLUMNS)
+        processed.insert(0, "sensor", args.inputs[index])
+        frames.append(processed)
+
+        log_message(2, f"{args.inputs[index]}: {len(processed)} samples processed in {elapsed:.1f} s")
+
+    pd.concat(frames, ignore_index = True).to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# A Qt-free entrypoint, for running the positioning algorithm without a display:
+#   python3 src/headless.py <input> <output.csv> [options]
+# The input is read as fast as it arrives (for recordings, as fast as the CPU allows)
+# and the accumulated data is exported once the input ends, or on Ctrl+C.
+
+import argparse
+
+from Sensor import MODES, Sensor, log_message
+from streams import open_stream
+import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run the MUGIC positioning algorithm without a GUI.")
+    parser.add_argument("input", help = 'a recording (.mrec or .pckl), "sim", "udp:<ip>:<port>" or "serial:<port>:<baud>"')
+    parser.add_argument("output", help = "the CSV file to export the raw and processed data to")
+    parser.add_argument("--batch-size", type = int, default = config.BATCH_SIZE)
+    parser.add_argument("--reuse-size", type = int, default = config.REUSE_SIZE)
+    parser.add_argument("--mode", choices = MODES, default = config.POSITIONING_MODE)
+    parser.add_argument("--max-batches", type = int, default = None, help = "stop after this many batches (eg. for looping simulated data)")
+    parser.add_argument("--speed", type = float, default = None, help = "replay .mrec recordings this many times faster than real time (default: as fast as possible)")
+    parser.add_argument("--publish", nargs = "+", default = config.PUBLISH_TO, help = 'subscribers to send the processed data to live, as "udp:<ip>:<port>" or "unix:<path>"')
+    parser.add_argument("--profile", default = None, help = "time each stage of processing, print a summary, and save it (with histograms) to this JSON file")
+    parser.add_argument("--analytics", action = "store_true", help = "print statistics of the bowing's stability and strokes at the end")
+    args = parser.parse_args()
+
+    stream = open_stream(args.input, speed = args.speed)
+    sensor = run(stream, args.batch_size, args.reuse_size, args.mode, args.max_batches, publish_to = args.publish, profile = args.profile is not None)
+
+    sensor.export_accumulated_data(args.output)
+    sensor.close()
+
+    if args.profile is not None:
+        print(sensor.profiler.report())
+        sensor.profiler.dump(args.profile)
+
+    if args.analytics:
+        print(sensor.analytics.report())
+
+    log_message(2, f"Processed {len(sensor.accumulated_processed)} samples into {args.output}")
+
+
+# Feeds the stream to a Sensor batch by batch, until the stream ends (or is interrupted),
+# and returns the Sensor holding the accumulated data
+# on_processed: called with each batch of newly processed data
+# should_stop: polled between batches, to end early
+# publish_to: subscribers to send the processed data to live (see publish.Publisher)
+# profile: whether to time each stage of processing (see profiling.Profiler)
+def run(stream, batch_size, reuse_size, mode = config.POSITIONING_MODE, max_batches = None, on_processed = None, should_stop = None,
+        publish_to = config.PUBLISH_TO, profile = config.PROFILE):
+    sensor = Sensor(stream, batch_size, reuse_size, mode, fetch = False, publish_to = publish_to, profile = profile)
+    sensor.toggle_recording()
+
+    n_batches = 0
+
+    try:
+        while max_batches is None or n_batches < max_batches:
+            if should_stop is not None and should_stop():
+                break
+
+            try:
+                raw_data = stream.readlines(batch_size)
+
+            except EOFError:
+                break
+
+            try:
+                new_data = sensor.process_batch(raw_data)
+
+                if on_processed is not None and new_data is not None:
+                    on_processed(new_data)
+
+            except AssertionError:
+                # We haven't collected enough data to begin analysis yet
+                pass
+
+            n_batches += 1
+
+    except KeyboardInterrupt:
+        log_message(2, "Interrupted, exporting what has been processed so far")
+
+    finally:
+        stream.close()
+
+    return sensor
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Reports how long the program's modules take to import, and which of their dependencies the time goes to.
+#   python3 src/import_report.py [module ...]
+# Each module is imported in a fresh interpreter (using python -X importtime), so that nothing is cached.
+# By default, this reports on what app.py imports before the config dialog shows up, and then on the pipeline.
+
+import argparse, os, subprocess, sys
+
+
+STARTUP_MODULES = ["ConfigWindow", "ErrorWindow", "config"]
+PIPELINE_MODULES = ["Sensor", "MainWindow"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Report the import time of the program's modules.")
+    parser.add_argument("modules", nargs = "*", default = None, help = "modules to import together (by default, the startup and the pipeline's, separately)")
+    parser.add_argument("--top", type = int, default = 10, help = "how many of the slowest top-level packages to list")
+    args = parser.parse_args()
+
+    groups = [args.modules] if args.modules else [STARTUP_MODULES, PIPELINE_MODULES]
+
+    for modules in groups:
+        total_us, packages, error = import_times(modules)
+
+        print(f"import {', '.join(modules)}: {total_us / 1000:.0f} ms" + (f" (failed: {error})" if error else ""))
+
+        for package, us in sorted(packages.items(), key = lambda item: -item[1])[:args.top]:
+            print(f"    {us / 1000:8.1f} ms  {package}")
+
+
+# Imports the modules in a new interpreter, returning the total time taken (in microseconds), the time taken
+# by each package they depend on (including everything it imports in turn, so packages can overlap),
+# and the error that stopped the import (if any). The interpreter's own startup imports aren't counted.
+def import_times(modules):
+    baseline, _ = _run_importtime("pass")
+    entries, error = _run_importtime("; ".join(f"import {module}" for module in modules))
+
+    total_us = 0
+    packages = {}
+    ancestors = [] # (depth, package) of the imports enclosing the current one
+    startup = False # whether the current import is part of the interpreter's startup
+
+    # Each import is listed after everything it imported, indented one level deeper. Going backwards,
+    # an import comes before what it imported, so the imports enclosing it are the ones above it on the stack
+    for depth, name, cumulative_us in reversed(entries):
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+
+        if depth == 0:
+            startup = name in baseline
+
+        if startup:
+            continue
+
+        package = name.split(".")[0]
+
+        if depth == 0:
+            total_us += cumulative_us
+
+        if all(package != outer for _, outer in ancestors):
+            packages[package] = packages.get(package, 0) + cumulative_us
+
+        ancestors.append((depth, package))
+
+    return total_us, packages, error
+
+
+# Runs python -X importtime on the code, returning the (depth, module name, cumulative microseconds)
+# of each import, in the order they finished, and the error the code raised (if any)
+def _run_importtime(code):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd = os.path.dirname(os.path.abspath(__file__)), capture_output = True, text = True
+    )
+
+    entries = []
+    error = None
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            if line.strip():
+                error = line.strip() # the last line of a traceback is the error itself
+            continue
+
+        fields = line[len("import time:"):].split("|")
+
+        if not fields[0].strip().isdigit():
+            continue # the header
+
+        name = fields[2].rstrip()[1:] # one space separates the columns; the rest is indentation
+        depth = (len(name) - len(name.lstrip())) // 2
+
+        entries.append((depth, name.strip(), int(fields[1])))
+
+    if code == "pass":
+        return { name for depth, name, _ in entries if depth == 0 }, None
+
+    return entries, error if result.returncode else None
+
+
+if __name__ == "__main__":
+    main()
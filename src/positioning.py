@@ -0,0 +1,195 @@
+# The positioning algorithm itself, on plain NumPy arrays, so it can be run outside the GUI (or the Sensor) altogether:
+#   positioner = create_positioner("windowed", reuse_size = 200)
+#   processed = positioner.process(samples, history)
+# Samples go in as an (n x 8) array of RAW_COLUMNS, and come out as an (n x 11) array of PROCESSED_COLUMNS.
+# The output is written straight into one array, column by column as each stage finishes, rather than assembled
+# from intermediate tables at the end; pass it in as `out` to reuse the same array from batch to batch.
+
+import numpy as np
+
+import config, tools
+from profiling import NO_PROFILER
+
+
+# The raw columns the positioning algorithm needs, and the columns it produces
+RAW_COLUMNS       = ["time_sec", "ax", "ay", "az", "qw", "qx", "qy", "qz"]
+PROCESSED_COLUMNS = ["time_sec", "vx", "vy", "vz", "x", "y", "z", "position", "velocity", "projected_X", "projected_Y"]
+
+# The ways position can be calculated (see config.POSITIONING_MODE)
+MODES = ("windowed", "streaming", "kalman")
+
+# Where everything is in a row of samples (RAW_COLUMNS)...
+TIME_INDEX   = RAW_COLUMNS.index("time_sec")
+ACCELERATION = slice(RAW_COLUMNS.index("ax"), RAW_COLUMNS.index("az") + 1)
+QUATERNION   = slice(RAW_COLUMNS.index("qw"), RAW_COLUMNS.index("qz") + 1)
+
+# ...and in a row of the output (PROCESSED_COLUMNS)
+PROCESSED_TIME = PROCESSED_COLUMNS.index("time_sec")
+VELOCITY       = slice(PROCESSED_COLUMNS.index("vx"), PROCESSED_COLUMNS.index("vz") + 1)
+POSITION       = slice(PROCESSED_COLUMNS.index("x"), PROCESSED_COLUMNS.index("z") + 1)
+POSITION_PC    = PROCESSED_COLUMNS.index("position")
+VELOCITY_PC    = PROCESSED_COLUMNS.index("velocity")
+PROJECTED      = slice(PROCESSED_COLUMNS.index("projected_X"), PROCESSED_COLUMNS.index("projected_Y") + 1)
+
+
+# The positioner for the given mode. Its state carries over from batch to batch, so make a new one to start over.
+# reuse_size: how much of the recent data the PC traces are worked out over (see the positioners below)
+# cutoff, order: the high pass filters' cutoff frequency (in Hz) and order, for the windowed and streaming modes
+# profiler: times each stage of the algorithm (see profiling.Profiler)
+def create_positioner(mode, reuse_size = config.REUSE_SIZE, cutoff = config.FILTER_CUTOFF_HZ, order = config.FILTER_ORDER,
+                      rotation_dtype = config.ROTATION_DTYPE, profiler = NO_PROFILER):
+    assert mode in MODES, f"Unknown positioning mode {mode}"
+
+    if mode == "windowed":
+        return WindowedPositioner(cutoff, order, rotation_dtype, profiler)
+
+    return StreamingPositioner(reuse_size, mode == "kalman", cutoff, order, rotation_dtype, profiler)
+
+
+# Given batches of raw samples, attempt to determine current velocity and position, as well as
+# the first principal components of those measurements and a projection of position onto the
+# other two components.
+# Each batch is filtered and integrated whole, with zero phase, so to keep the batches connected,
+# each is given along with some of the samples before it (the reuse window). Integrating from scratch
+# leaves each batch's velocity and position offset from the last's, which the integration correction undoes.
+class WindowedPositioner:
+    def __init__(self, cutoff = config.FILTER_CUTOFF_HZ, order = config.FILTER_ORDER,
+                 rotation_dtype = config.ROTATION_DTYPE, profiler = NO_PROFILER):
+        self.cutoff = cutoff
+        self.order = order
+        self.rotation_dtype = rotation_dtype
+        self.profiler = profiler
+
+        # Principal axes from the last batch, to keep the PC traces' signs consistent from batch to batch
+        self.velocity_rotation = None
+        self.position_rotation = None
+
+    # samples: (n x 8) array of RAW_COLUMNS, the reuse window followed by the new samples
+    # history: the latest processed rows (in PROCESSED_COLUMNS), for the integration correction. The mean velocity
+    # and position of the first as many of the samples are moved to match theirs. None for no correction
+    # (ie. for the first batch, which has nothing to be connected to)
+    # out: an (n x 11) array to write the output to, rather than a new one
+    def process(self, samples, history = None, out = None):
+        time_sec = samples[:, TIME_INDEX]
+        out = _output_array(samples, out)
+        velocity, position = out[:, VELOCITY], out[:, POSITION]
+
+        with self.profiler.stage("rotate"):
+            linear_acceleration = tools.rotate_by_quaternions(samples[:, QUATERNION], samples[:, ACCELERATION], dtype = self.rotation_dtype)
+
+        with self.profiler.stage("velocity_filter"):
+            tools.filter_and_integrate(linear_acceleration, time_sec, self.cutoff, self.order, out = velocity)
+
+        if history is not None:
+            with self.profiler.stage("velocity_correction"):
+                velocity += history[:, VELOCITY].mean(axis = 0) - velocity[:len(history)].mean(axis = 0)
+
+        with self.profiler.stage("position_filter"):
+            tools.filter_and_integrate(velocity, time_sec, self.cutoff, self.order, out = position)
+
+        if history is not None:
+            with self.profiler.stage("position_correction"):
+                position += history[:, POSITION].mean(axis = 0) - position[:len(history)].mean(axis = 0)
+
+        with self.profiler.stage("PCA"):
+            self.velocity_rotation, velocity_PCs = tools.PCA(velocity, self.velocity_rotation)
+            self.position_rotation, position_PCs = tools.PCA(position, self.position_rotation)
+
+            out[:, PROCESSED_TIME] = time_sec
+            out[:, VELOCITY_PC] = velocity_PCs[:, 1]
+            out[:, POSITION_PC] = position_PCs[:, 1]
+            out[:, PROJECTED] = tools.project_3D_to_2D(position, self.position_rotation[:, 0])
+
+        return out
+
+
+# The streaming alternative to the windowed algorithm above. Rather than re-filtering and re-integrating
+# the reuse window every batch, only the new samples are run through causal filters and integrators
+# that carry their state over from the previous batch. No integration correction is needed, since the
+# integrals continue exactly where they left off. The first call (with the calibration data) sets them up.
+# kalman: whether a Kalman filter should stand in for the filters and integrators, updating sample by sample
+# (so that the output, PC traces included, is the same however the samples are batched, down to batches of 1).
+# The principal axes are updated from running sums, forgetting data older than about reuse_size samples,
+# so they needn't be recomputed over the recent window either.
+class StreamingPositioner:
+    def __init__(self, reuse_size = config.REUSE_SIZE, kalman = False, cutoff = config.FILTER_CUTOFF_HZ,
+                 order = config.FILTER_ORDER, rotation_dtype = config.ROTATION_DTYPE, profiler = NO_PROFILER):
+        self.kalman = kalman
+        self.cutoff = cutoff
+        self.order = order
+        self.rotation_dtype = rotation_dtype
+        self.profiler = profiler
+
+        # Set up from the first batch
+        self.velocity_integrator = None
+        self.position_integrator = None
+        self.kalman_integrator = None
+
+        self.velocity_PCA = tools.RunningPCA(window = reuse_size)
+        self.position_PCA = tools.RunningPCA(window = reuse_size)
+
+    # samples: (n x 8) array of RAW_COLUMNS, only the new ones
+    # history: not needed, since the integrals carry on from the last call (it's accepted so either positioner will do)
+    # out: an (n x 11) array to write the output to, rather than a new one
+    def process(self, samples, history = None, out = None):
+        time_sec = samples[:, TIME_INDEX]
+        out = _output_array(samples, out)
+
+        with self.profiler.stage("rotate"):
+            linear_acceleration = tools.rotate_by_quaternions(samples[:, QUATERNION], samples[:, ACCELERATION], dtype = self.rotation_dtype)
+
+        if self.kalman:
+            if self.kalman_integrator is None:
+                self.kalman_integrator = tools.KalmanIntegrator(3)
+
+            with self.profiler.stage("kalman"):
+                velocity, position = self.kalman_integrator.process(linear_acceleration, time_sec)
+
+        else:
+            if self.velocity_integrator is None:
+                samp_rate = samples.shape[0] / (time_sec.max() - time_sec.min())
+
+                self.velocity_integrator = tools.StreamingFilterIntegrator(samp_rate, 3, self.cutoff, self.order)
+                self.position_integrator = tools.StreamingFilterIntegrator(samp_rate, 3, self.cutoff, self.order)
+
+            with self.profiler.stage("filter"):
+                velocity = self.velocity_integrator.process(linear_acceleration)
+                position = self.position_integrator.process(velocity)
+
+        out[:, PROCESSED_TIME] = time_sec
+        out[:, VELOCITY] = velocity
+        out[:, POSITION] = position
+
+        with self.profiler.stage("PCA"):
+            if self.kalman:
+                self._principal_components_each(velocity, position, out)
+
+            else:
+                self.velocity_PCA.update(velocity)
+                self.position_PCA.update(position)
+
+                out[:, VELOCITY_PC] = self.velocity_PCA.transform(velocity)[:, 1]
+                out[:, POSITION_PC] = self.position_PCA.transform(position)[:, 1]
+                out[:, PROJECTED] = tools.project_3D_to_2D(position, self.position_PCA.rotation[:, 0])
+
+        return out
+
+    # The Kalman filter's output doesn't depend on how the samples are batched, so neither should the PC traces:
+    # the axes are updated a sample at a time, and each sample is transformed by the axes as they were just after it.
+    # (Otherwise, the newest axes would be applied to the whole batch.) It costs a 3x3 eigen solve per sample.
+    def _principal_components_each(self, velocity, position, out):
+        velocity_PCs, _ = self.velocity_PCA.update_each(velocity)
+        position_PCs, position_rotations = self.position_PCA.update_each(position)
+
+        out[:, VELOCITY_PC] = velocity_PCs[:, 1]
+        out[:, POSITION_PC] = position_PCs[:, 1]
+        out[:, PROJECTED] = tools.project_each_3D_to_2D(position, position_rotations[:, :, 0])
+
+
+def _output_array(samples, out):
+    if out is None:
+        return np.empty((samples.shape[0], len(PROCESSED_COLUMNS)))
+
+    assert out.shape == (samples.shape[0], len(PROCESSED_COLUMNS)), f"out should be {samples.shape[0]} x {len(PROCESSED_COLUMNS)}"
+
+    return out
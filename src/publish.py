@@ -0,0 +1,109 @@
+# Publishes processed data live to other programs (eg. Max/MSP, SuperCollider, synthesis engines) as OSC.
+# Each processed batch is sent as one OSC bundle, holding one message per sample:
+#   /mugic/sample  time_sec (double)  position velocity projected_X projected_Y (floats)
+# to every subscriber, given as "udp:<ip>:<port>" or "unix:<socket path>" (a datagram socket).
+#
+# Sockets are non-blocking, so publishing never waits: if a subscriber isn't listening, or can't keep up,
+# its datagrams are simply lost (and counted), and the positioning algorithm carries on.
+
+import socket
+import numpy as np
+
+import config
+
+
+ADDRESS = "/mugic/sample"
+COLUMNS = ["time_sec", "position", "velocity", "projected_X", "projected_Y"]
+
+MAX_DATAGRAM_BYTES = 8192 # larger batches are split into several bundles, to stay well under any UDP limit
+BUNDLE_HEADER = b"#bundle\0" + (1).to_bytes(8, "big") # the "immediately" time tag
+
+
+# An OSC string: null-terminated, padded with nulls to a multiple of 4 bytes
+def osc_string(text):
+    encoded = text.encode() + b"\0"
+    return encoded + b"\0" * (-len(encoded) % 4)
+
+
+# The layout of one sample's bundle element (its size, then the message), so a whole batch is encoded at once
+def _element_dtype(address, columns):
+    address, type_tags = osc_string(address), osc_string("," + "d" + "f" * (len(columns) - 1))
+
+    fields = [("size", ">i4"), ("address", f"S{len(address)}"), ("type_tags", f"S{len(type_tags)}"), (columns[0], ">f8")]
+    fields += [(col, ">f4") for col in columns[1:]]
+
+    return np.dtype(fields), address, type_tags
+
+
+# Encodes a batch of samples as OSC bundles, each fitting in one datagram.
+# rows: (n x len(columns)) array, the first column being the time (sent as a double)
+def encode_bundles(rows, address = ADDRESS, columns = COLUMNS):
+    dtype, address, type_tags = _element_dtype(address, columns)
+
+    elements = np.empty(len(rows), dtype = dtype)
+    elements["size"] = dtype.itemsize - 4
+    elements["address"] = address
+    elements["type_tags"] = type_tags
+
+    for i, col in enumerate(columns):
+        elements[col] = rows[:, i]
+
+    per_bundle = max(1, (MAX_DATAGRAM_BYTES - len(BUNDLE_HEADER)) // dtype.itemsize)
+
+    return [BUNDLE_HEADER + elements[i : i + per_bundle].tobytes() for i in range(0, len(elements), per_bundle)]
+
+
+class Publisher:
+    # subscribers: descriptions, as "udp:<ip>:<port>" or "unix:<socket path>"
+    def __init__(self, subscribers = config.PUBLISH_TO, address = ADDRESS, columns = COLUMNS):
+        self.address = address
+        self.columns = list(columns)
+
+        self.subscribers = [_open_subscriber(description) for description in subscribers]
+
+        self.sent = 0    # datagrams handed to the OS
+        self.dropped = 0 # datagrams a subscriber couldn't take (not listening, or its buffer was full)
+
+    # new_data: a DataFrame (or dict of columns) holding at least our columns
+    def publish(self, new_data):
+        if not self.subscribers or len(new_data[self.columns[0]]) == 0:
+            return
+
+        rows = np.column_stack([np.asarray(new_data[col], dtype = np.float64) for col in self.columns])
+
+        for bundle in encode_bundles(rows, self.address, self.columns):
+            for connection, destination in self.subscribers:
+                try:
+                    connection.sendto(bundle, destination)
+                    self.sent += 1
+
+                except OSError:
+                    # BlockingIOError (the socket's buffer is full), ConnectionRefusedError, a missing socket file, ...
+                    self.dropped += 1
+
+    def close(self):
+        for connection, _ in self.subscribers:
+            connection.close()
+
+        self.subscribers = []
+
+
+# Returns a non-blocking socket for the subscriber, and the destination to send to
+def _open_subscriber(description):
+    kind, _, args = description.partition(":")
+
+    if kind == "udp":
+        ip, port = args.rsplit(":", 1)
+        connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        destination = (ip, int(port))
+
+    elif kind == "unix":
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        destination = args
+
+    else:
+        raise ValueError(f"Don't know how to publish to {description}")
+
+    connection.setblocking(False)
+
+    return connection, destination
@@ -0,0 +1,83 @@
+from queue import Empty
+import collections, threading
+
+
+class Closed(Exception):
+    pass
+
+
+# A thread-safe queue that holds at most maxsize items, for when its consumer can fall behind its producer.
+# What put does when the queue is full depends on the policy:
+#   "block":       wait for room. Nothing is lost, but the wait (and so latency) can grow.
+#   "drop_oldest": throw out the oldest item to make room. Latency stays bounded, at the cost of old data.
+#   "coalesce":    merge the new item into the newest queued one, using merge(older, newer). Nothing is lost,
+#                  and the consumer catches up by taking more at once.
+# Like queue.Queue, get raises queue.Empty when there's nothing to get.
+# Once closed, put raises Closed (so a producer waiting for room isn't left waiting forever), and get
+# stops waiting for more, though what's still queued can be taken.
+class BoundedQueue:
+    POLICIES = ("block", "drop_oldest", "coalesce")
+
+    def __init__(self, maxsize, policy = "drop_oldest", merge = None):
+        assert policy in self.POLICIES, f"Unknown queue policy {policy}"
+        assert policy != "coalesce" or merge is not None, "The coalesce policy needs a merge function"
+
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.merge = merge
+
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+
+        self.dropped = 0   # items thrown out by drop_oldest
+        self.coalesced = 0 # items merged into another by coalesce
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if self.closed:
+                raise Closed
+
+            if len(self.items) >= self.maxsize:
+                if self.policy == "block":
+                    self.condition.wait_for(lambda: len(self.items) < self.maxsize or self.closed)
+
+                    if self.closed:
+                        raise Closed
+
+                elif self.policy == "drop_oldest":
+                    self.items.popleft()
+                    self.dropped += 1
+
+                else:
+                    self.items[-1] = self.merge(self.items[-1], item)
+                    self.coalesced += 1
+                    return
+
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self, block = True, timeout = None):
+        with self.condition:
+            if block and not self.condition.wait_for(lambda: self.items or self.closed, timeout):
+                raise Empty
+
+            if not self.items:
+                raise Empty
+
+            item = self.items.popleft()
+            self.condition.notify_all()
+
+            return item
+
+    # Wakes up anything waiting on the queue, and refuses anything more
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get_nowait(self):
+        return self.get(block = False)
+
+    def qsize(self):
+        return len(self.items)
@@ -0,0 +1,198 @@
+# A compact binary format for recorded sensor data, which can be memory-mapped rather than loaded.
+# Sessions can also be recorded to it as they happen, and converted to CSV afterwards.
+#   python3 src/recordings.py <recording.pckl> <recording.mrec>
+# converts an old pickled list of raw lines (like data/simdata.pckl) to this format.
+#
+# A recording file is:
+#   the magic bytes MUGICREC,
+#   a little-endian uint32 giving the length of the header that follows,
+#   a JSON header, {"version": 1, "columns": [...], "dtype": "<f8"}, padded so the data starts 64-byte aligned,
+#   the rows, as a C-ordered (n_rows x n_columns) array of dtype.
+# The number of rows isn't stored, so a recording can be appended to while it's open (and survive a crash).
+
+import argparse, json, os, pickle, struct
+import numpy as np
+
+from queue import Queue
+from threading import Thread
+
+import config
+
+
+MAGIC = b"MUGICREC"
+VERSION = 1
+ALIGNMENT = 64
+
+
+# Writes rows to a new recording file, a chunk at a time
+class RecordingWriter:
+    def __init__(self, path, columns = config.COLUMNS, dtype = "<f8"):
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self.file = open(path, "wb")
+
+        header = json.dumps({ "version": VERSION, "columns": self.columns, "dtype": self.dtype.str }).encode()
+        padding = -(len(MAGIC) + 4 + len(header)) % ALIGNMENT
+
+        self.file.write(MAGIC + struct.pack("<I", len(header) + padding) + header + b" " * padding)
+
+    # rows: (n x len(columns)) array, in the order of this recording's columns
+    def append(self, rows):
+        self.file.write(np.ascontiguousarray(rows, dtype = self.dtype).tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# A recording opened for reading. Its rows are memory-mapped, so only the parts actually read are loaded.
+class Recording:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a MUGIC recording")
+
+            header_length, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+
+        if header["version"] > VERSION:
+            raise ValueError(f"{path} was recorded in a newer format (version {header['version']})")
+
+        self.path = path
+        self.columns = header["columns"]
+        self.dtype = np.dtype(header["dtype"])
+
+        offset = len(MAGIC) + 4 + header_length
+        row_bytes = self.dtype.itemsize * len(self.columns)
+        n_rows = (os.path.getsize(path) - offset) // row_bytes # ignoring a partly-written last row
+
+        if n_rows > 0:
+            self.rows = np.memmap(path, dtype = self.dtype, mode = "r", offset = offset, shape = (n_rows, len(self.columns)))
+
+        else:
+            self.rows = np.empty((0, len(self.columns)), dtype = self.dtype)
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+    # A view of one column of the recording
+    def column(self, name):
+        return self.rows[:, self.columns.index(name)]
+
+    # A view of the rows in that range
+    def read(self, start, end):
+        return self.rows[start:end]
+
+
+# Records a session's raw and processed data to <path_prefix>.raw.mrec and <path_prefix>.processed.mrec
+# as it's produced, rather than all at once at the end. Chunks are handed to a writer thread,
+# so the caller never waits on the disk. Use session_to_csv to convert the session afterwards.
+class SessionRecorder:
+    def __init__(self, path_prefix, raw_columns, processed_columns):
+        self.path_prefix = path_prefix
+        self.writers = {
+            "raw": RecordingWriter(path_prefix + ".raw.mrec", raw_columns),
+            "processed": RecordingWriter(path_prefix + ".processed.mrec", processed_columns)
+        }
+
+        self.chunks = Queue()
+        self.writing_thread = Thread(target = self._write_chunks, daemon = True)
+        self.writing_thread.start()
+
+    # rows: (n x len(columns)) array, in the order of the columns given for that file
+    def write_raw(self, rows):
+        self.chunks.put(("raw", np.array(rows))) # copied, in case the caller reuses its array
+
+    def write_processed(self, rows):
+        self.chunks.put(("processed", np.array(rows)))
+
+    # Waits until everything written so far is on disk
+    def flush(self):
+        self.chunks.join()
+
+        for writer in self.writers.values():
+            writer.flush()
+
+    def close(self):
+        self.chunks.put(None)
+        self.writing_thread.join()
+
+        for writer in self.writers.values():
+            writer.close()
+
+    def _write_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+
+            if chunk is None:
+                self.chunks.task_done()
+                break
+
+            kind, rows = chunk
+            self.writers[kind].append(rows)
+            self.chunks.task_done()
+
+
+# Converts a session recorded by SessionRecorder to one CSV (see tables_to_csv)
+def session_to_csv(path_prefix, csv_path, chunk_rows = 100000):
+    tables_to_csv(Recording(path_prefix + ".raw.mrec"), Recording(path_prefix + ".processed.mrec"), csv_path, chunk_rows)
+
+
+# Writes raw and processed data side by side to one CSV, a chunk of rows at a time, so that memory use
+# doesn't grow with the length of the session. The i-th processed row belongs to the i-th raw row; raw rows
+# that were never processed (ie. withheld for calibration when recording stopped) have empty processed columns.
+# raw, processed: tables of rows, such as Recordings or buffers.SpillingColumnBuffers (anything with columns,
+# a length, and read(start, end) returning the rows in that range)
+def tables_to_csv(raw, processed, csv_path, chunk_rows = 100000):
+    import pandas as pd # here, so that opening streams (eg. at startup) doesn't wait on loading pandas
+
+    processed_columns = [col for col in processed.columns if col not in raw.columns]
+    processed_indices = [processed.columns.index(col) for col in processed_columns]
+
+    with open(csv_path, "w", newline = "") as f:
+        for start in range(0, max(1, len(raw)), chunk_rows):
+            end = min(len(raw), start + chunk_rows)
+
+            chunk = np.full((end - start, len(processed_columns)), np.nan)
+            n_processed = max(0, min(end, len(processed)) - start)
+            chunk[:n_processed] = processed.read(start, start + n_processed)[:, processed_indices]
+
+            frame = pd.concat([
+                pd.DataFrame(raw.read(start, end), columns = raw.columns),
+                pd.DataFrame(chunk, columns = processed_columns)
+            ], axis = 1)
+            frame.index += start
+
+            frame.to_csv(f, header = start == 0)
+
+
+# Converts a pickled list of raw lines from the sensor (as SimulatedStream replays) to a recording
+def convert_pickle(pickle_path, recording_path):
+    from Sensor import parse_bytes # here, so that reading recordings doesn't depend on the whole positioning pipeline
+
+    with open(pickle_path, "rb") as f:
+        lines = pickle.load(f)
+
+    rows, n_corrupt = parse_bytes(lines, config.COLUMNS)
+
+    writer = RecordingWriter(recording_path, config.COLUMNS)
+    writer.append(rows)
+    writer.close()
+
+    return rows.shape[0], n_corrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert a pickled list of raw sensor lines to a binary recording.")
+    parser.add_argument("pickle", help = "the .pckl file to convert")
+    parser.add_argument("recording", help = "the recording file (.mrec) to write")
+    args = parser.parse_args()
+
+    n_rows, n_corrupt = convert_pickle(args.pickle, args.recording)
+    print(f"Wrote {n_rows} samples to {args.recording} ({n_corrupt} corrupt lines thrown out)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import math
+
+
+# Adapts the number of lines fetched per batch to how long processing takes, compared to how long the sensor
+# takes to produce them (the utilization). With room to spare, batches shrink, so new data is shown sooner;
+# when processing can't keep up, they grow, so its fixed costs (eg. the reuse window) are spread over more samples.
+# Batches that queue up anyway are merged and processed in one go (see Sensor.process_next_batch).
+# Every change is kept in decisions (and logged by the Sensor), so it can be seen how it settled on a batch size.
+class BatchScheduler:
+    # batch_size: the size to start from, which can shrink to min_batch_size or grow to max_batch_size
+    # (by default, a quarter and four times of it)
+    # low, high: the utilizations below which batches shrink, and above which they grow
+    # patience: how many batches to measure between changes, so that each change has a chance to show its effect
+    def __init__(self, batch_size, min_batch_size = None, max_batch_size = None, low = 0.25, high = 0.7, patience = 5):
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size or max(1, batch_size // 4)
+        self.max_batch_size = max_batch_size or 4 * batch_size
+        self.low = low
+        self.high = high
+        self.patience = patience
+
+        self.utilization = None # smoothed over the last few batches
+        self.n_measured = 0     # batches measured since the last change
+        self.decisions = []     # dicts of the time (by the sensor's clock), old and new sizes, and why
+
+    # To be called after each batch is processed, with its number of samples, how many seconds they took to arrive,
+    # how many seconds processing them took, and how many batches were still waiting afterwards.
+    # One batch arriving during processing is normal when utilization is high; more than that means falling behind.
+    # Returns the decision made, if the batch size changed
+    def record(self, n_samples, arrival_seconds, processing_seconds, backlog = 0, time_sec = None):
+        if n_samples == 0 or arrival_seconds <= 0:
+            return None
+
+        utilization = processing_seconds / arrival_seconds
+        self.utilization = utilization if self.utilization is None else 0.8 * self.utilization + 0.2 * utilization
+        self.n_measured += 1
+
+        falling_behind = backlog > 1
+
+        if self.n_measured < self.patience and not falling_behind:
+            return None
+
+        if falling_behind or self.utilization > self.high:
+            reason = f"falling behind ({backlog} batches waiting)" if falling_behind else f"utilization {self.utilization:.0%}"
+            return self._resize(math.ceil(self.batch_size * 1.5), reason, time_sec)
+
+        elif self.utilization < self.low:
+            return self._resize(math.floor(self.batch_size * 0.75), f"utilization {self.utilization:.0%}", time_sec)
+
+        return None
+
+    def _resize(self, batch_size, reason, time_sec):
+        batch_size = min(self.max_batch_size, max(self.min_batch_size, batch_size))
+        self.n_measured = 0
+
+        if batch_size == self.batch_size:
+            return None
+
+        decision = { "time_sec": time_sec, "from": self.batch_size, "to": batch_size, "reason": reason }
+        self.decisions.append(decision)
+        self.batch_size = batch_size
+
+        return decision
@@ -1,13 +1,27 @@
-import os, pickle, socket, sys, time
+import collections, os, pickle, socket, sys, time
+import numpy as np
 import serial  # pySerial package
 
+import config, recordings
+
 # Template class
 class _DataStream:
     def readline(self):
         pass
 
+    # At the end of the stream, the lines read so far are returned, and EOFError is only raised on the next call
     def readlines(self, n):
-        return [self.readline() for _ in range(n)]
+        lines = []
+
+        try:
+            for _ in range(n):
+                lines.append(self.readline())
+
+        except EOFError:
+            if not lines:
+                raise
+
+        return lines
 
     def read_for_time(self, seconds):
         output = []
@@ -21,37 +35,84 @@ class _DataStream:
     def close(self):
         pass
 
+# Reads in chunks of whatever the port has waiting, rather than pyserial's byte-by-byte readline,
+# keeping the complete lines and carrying a trailing partial line over to the next read.
 class SerialStream(_DataStream):
     def __init__(self, port, baud):
         self.connection = serial.Serial(port, int(baud))
 
+        self.lines = collections.deque()
+        self.partial_line = b""
+        self.started_mid_line = True # we likely connected mid-broadcast, so the first line is thrown out
+
+        self.sequence = SequenceTracker()
+
     def readline(self):
-        return self.connection.readline()
+        while not self.lines:
+            self._read_chunk()
+
+        line = self.lines.popleft()
+        self.sequence.track((line,))
+
+        return line
+
+    def readlines(self, n):
+        while len(self.lines) < n:
+            self._read_chunk()
+
+        lines = [self.lines.popleft() for _ in range(n)]
+        self.sequence.track(lines)
+
+        return lines
+
+    # Waits for at least one byte, then takes everything else that has arrived along with it
+    def _read_chunk(self):
+        chunk = self.connection.read(max(1, self.connection.in_waiting))
+        *complete_lines, self.partial_line = (self.partial_line + chunk).split(b"\n")
+
+        if self.started_mid_line and complete_lines:
+            complete_lines = complete_lines[1:]
+            self.started_mid_line = False
+
+        self.lines.extend(complete_lines)
 
     def close(self):
         self.connection.close()
 
-# Simulates a sensor from previously-saved raw data (a pickled list of bytes)
+# Simulates a sensor from previously-saved raw data (a pickled list of bytes).
+# path: the recording to replay (by default, the bundled data/simdata.pckl)
+# delay_ms: the time between lines, or 0 to replay as fast as they are asked for
+# loop: whether to start over at the end of the recording, rather than raising EOFError
 class SimulatedStream(_DataStream):
-    def __init__(self, delay_ms=10):
-        try:
-            root_dir = sys._MEIPASS # if built with pyinstaller
-        
-        except AttributeError:
-            root_dir = './src'
+    def __init__(self, delay_ms=10, path=None, loop=True):
+        if path is None:
+            try:
+                root_dir = sys._MEIPASS # if built with pyinstaller
+            
+            except AttributeError:
+                root_dir = './src'
 
+            path = os.path.join(root_dir, "data", "simdata.pckl")
 
-        with open(os.path.join(root_dir, "data", "simdata.pckl"), 'rb') as f:
+        with open(path, 'rb') as f:
             self.data = pickle.load(f)
         
         self.row_index = 0
         self.delay_sec = delay_ms / 1000
+        self.loop = loop
 
     def readline(self):
-        time.sleep(self.delay_sec)
+        if self.delay_sec:
+            time.sleep(self.delay_sec)
+
+        if self.row_index == len(self.data):
+            raise EOFError("Reached the end of the recording")
 
         row = self.data[self.row_index]
-        self.row_index = (self.row_index + 1) % len(self.data)
+        self.row_index += 1
+
+        if self.loop:
+            self.row_index %= len(self.data)
 
         return row
     
@@ -59,16 +120,180 @@ class SimulatedStream(_DataStream):
         # We need to do something that will cause readline to throw an exception, killing the data fetching thread
         self.data = None
 
+# Replays a binary recording (see recordings.py), paced by the timestamps it was recorded with.
+# Rather than raw lines, it gives rows that are already parsed, in the order of config.COLUMNS
+# (with NaN for any columns the recording doesn't have). The recording is memory-mapped, not loaded.
+# speed: how many times faster than real time to replay, or None for as fast as possible
+# loop: whether to start over at the end of the recording, rather than raising EOFError
+class RecordingStream(_DataStream):
+    def __init__(self, path, speed=1.0, loop=False):
+        self.recording = recordings.Recording(path)
+        self.times = self.recording.column("time_sec")
+        self.speed = speed
+        self.loop = loop
+
+        self.row_index = 0
+        self.clock_start = None # (wall time, recorded time) that the replay is paced from
+
+        present = [col for col in config.COLUMNS if col in self.recording.columns]
+        self.target_indices = [config.COLUMNS.index(col) for col in present]
+        self.source_indices = [self.recording.columns.index(col) for col in present]
+
+    def readline(self):
+        return self.readlines(1)[0]
+
+    def readlines(self, n):
+        if self.recording is None:
+            raise EOFError("The stream was closed")
+
+        chunks = []
+
+        while n > 0:
+            if self.row_index == len(self.recording):
+                if not self.loop or len(self.recording) == 0:
+                    if chunks:
+                        break # the rest of the batch; EOFError comes on the next call
+
+                    raise EOFError("Reached the end of the recording")
+
+                self.row_index = 0
+                self.clock_start = None
+
+            if self.clock_start is None:
+                self.clock_start = (time.time(), self.times[self.row_index])
+
+            end = min(len(self.recording), self.row_index + n)
+            chunks.append(self._as_columns(self.recording.rows[self.row_index : end]))
+
+            # A batch arrives when its last sample does
+            self._wait_until(self.times[end - 1])
+
+            n -= end - self.row_index
+            self.row_index = end
+
+        return chunks[0] if len(chunks) == 1 else np.vstack(chunks)
+
+    # Copies rows of the recording into an array ordered as config.COLUMNS
+    def _as_columns(self, rows):
+        output = np.full((rows.shape[0], len(config.COLUMNS)), np.nan)
+        output[:, self.target_indices] = rows[:, self.source_indices]
+
+        return output
+
+    def _wait_until(self, recorded_time):
+        if self.speed is None:
+            return
+
+        wall_start, recorded_start = self.clock_start
+        delay = wall_start + (recorded_time - recorded_start) / self.speed - time.time()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def close(self):
+        self.recording = None
+
 class UDPStream(_DataStream):
+    RECEIVE_BUFFER_BYTES = 1 << 20 # room for a few seconds of packets, in case we're slow to collect a batch
+    MAX_PACKET_BYTES = 1024
+
     def __init__(self, ip, port):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER_BYTES)
 
         self.socket.bind((ip, int(port)))
 
+        self.sequence = SequenceTracker()
+
     def readline(self):
-        data, addr = self.socket.recvfrom(1024)
+        data = self.socket.recv(self.MAX_PACKET_BYTES)
+        self.sequence.track((data,))
 
         return data
 
+    # Each packet is one line, so a batch is just the next n packets, received in a tight loop
+    def readlines(self, n):
+        recv, size = self.socket.recv, self.MAX_PACKET_BYTES
+        lines = [recv(size) for _ in range(n)]
+
+        self.sequence.track(lines)
+
+        return lines
+
     def close(self):
         self.socket.close()
+
+# Counts the packets lost, delivered out of order or delivered twice, from the SequenceNum that ends each line.
+# A packet arriving after a later one was first counted as dropped, so it is moved over to reordered.
+# The numbers skipped over recently are remembered, to tell such a packet from a duplicate of one already received.
+class SequenceTracker:
+    RESTART_GAP = 1000 # a jump back further than this means the device restarted its count
+
+    def __init__(self):
+        self.last = None
+        self.missing = set() # numbers skipped over (within RESTART_GAP of the last), which may yet arrive
+        self.received = 0
+        self.dropped = 0
+        self.reordered = 0
+        self.duplicates = 0
+
+    def track(self, lines):
+        for line in lines:
+            try:
+                number = int(float(line.rsplit(None, 1)[-1]))
+
+            except (ValueError, IndexError):
+                continue
+
+            self.received += 1
+
+            if self.last is None or number < self.last - self.RESTART_GAP:
+                self.last = number
+                self.missing.clear()
+
+            elif number > self.last:
+                self.dropped += number - self.last - 1
+                self.missing.update(range(max(self.last + 1, number - self.RESTART_GAP), number))
+                self.last = number
+
+                if len(self.missing) > self.RESTART_GAP:
+                    self.missing = { missing for missing in self.missing if missing >= number - self.RESTART_GAP }
+
+            elif number in self.missing:
+                self.missing.remove(number)
+                self.reordered += 1
+                self.dropped -= 1
+
+            else:
+                self.duplicates += 1
+
+# Opens a stream from a short description, for use on the command line:
+#   "sim"                 the bundled simulated data, looping
+#   "udp:<ip>:<port>"     a MUGIC on WiFi
+#   "serial:<port>:<baud>" a MUGIC on USB
+#   <path to a .mrec>     a binary recording, replayed once
+#   <path to a .pckl>     a pickled recording, replayed once
+# delay_ms: for simulated data and pickled recordings, the time between lines (0 for as fast as possible)
+# speed: for binary recordings, how many times faster than real time to replay (None for as fast as possible)
+def open_stream(description, delay_ms=0, speed=None):
+    kind, _, args = description.partition(":")
+
+    if kind == "sim":
+        return SimulatedStream(delay_ms=delay_ms)
+
+    elif kind == "udp":
+        ip, port = args.rsplit(":", 1)
+        return UDPStream(ip, port)
+
+    elif kind == "serial":
+        port, baud = args.rsplit(":", 1)
+        return SerialStream(port, baud)
+
+    elif os.path.isfile(description) and description.endswith(".mrec"):
+        return RecordingStream(description, speed=speed)
+
+    elif os.path.isfile(description):
+        return SimulatedStream(delay_ms=delay_ms, path=description, loop=False)
+
+    else:
+        raise ValueError(f"Don't know how to open a stream from {description}")
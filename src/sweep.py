@@ -0,0 +1,146 @@
+# Sweeps the positioning algorithm's parameters over recorded sessions, one configuration per process
+# (on every core, by default), and collects how each configuration did into one table:
+#   python3 src/sweep.py <results.csv> <recording> [<recording> ...] [--batch-sizes 10 20] [--cutoffs 0.2 0.36 0.5] ...
+# Every combination of the given parameters is run over every recording (the kalman mode ignores the cutoffs and
+# orders, so it's run once per batch and reuse size, with those left blank). For each, the table holds:
+#   drift:       how fast the position wanders off, as the size of its overall linear trend (units/s)
+#   spread:      the RMS distance of the position from its mean, for scale
+#   stability:   the bowing stability, as the total variance of the projected points (projected_X, projected_Y),
+#                with ellipse_major and ellipse_minor, the standard deviations along their principal axes
+#                (the smaller, the steadier the bow's path; see analytics.py for the same, live)
+#   seam_ratio:  how much bigger the position's steps are at the joins between batches than within them
+#                (1 means the batches join seamlessly; the windowed mode's integration correction aims for this)
+#   p50_ms, p99_ms, realtime_factor: the time taken per batch, and how many times faster than real time it ran
+
+import argparse, itertools, multiprocessing, os, time
+import numpy as np
+import pandas as pd
+
+from Sensor import MODES, Sensor
+from streams import open_stream
+import config
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Sweep the MUGIC positioning algorithm's parameters over recordings, in parallel.")
+    parser.add_argument("output", help = "the CSV file to store the table of results in")
+    parser.add_argument("inputs", nargs = "+", help = "recordings (.mrec or .pckl) to run each configuration over")
+    parser.add_argument("--modes", nargs = "+", choices = MODES, default = [config.POSITIONING_MODE])
+    parser.add_argument("--batch-sizes", type = int, nargs = "+", default = [config.BATCH_SIZE])
+    parser.add_argument("--reuse-sizes", type = int, nargs = "+", default = [config.REUSE_SIZE])
+    parser.add_argument("--cutoffs", type = float, nargs = "+", default = [config.FILTER_CUTOFF_HZ], help = "high pass cutoffs, in Hz")
+    parser.add_argument("--orders", type = int, nargs = "+", default = [config.FILTER_ORDER], help = "high pass filter orders")
+    parser.add_argument("--processes", type = int, default = os.cpu_count(), help = "how many configurations to run at once (default: one per core)")
+    args = parser.parse_args()
+
+    jobs = list(dict.fromkeys(
+        (path, mode, batch_size, reuse_size, cutoff, order) if mode != "kalman" else (path, mode, batch_size, reuse_size, None, None)
+        for path, mode, batch_size, reuse_size, cutoff, order
+        in itertools.product(args.inputs, args.modes, args.batch_sizes, args.reuse_sizes, args.cutoffs, args.orders)
+        if reuse_size > batch_size # the integration correction needs the reuse window to be longer than a batch
+    ))
+
+    start_time = time.time()
+    results = []
+
+    with multiprocessing.Pool(args.processes) as pool:
+        for result in pool.imap_unordered(run_configuration, jobs):
+            results.append(result)
+            print(f"[{len(results)}/{len(jobs)}] " + ", ".join(f"{key} {value:.4g}" if isinstance(value, float) else f"{key} {value}" for key, value in result.items()))
+
+    table = pd.DataFrame(results).sort_values(["input", "mode", "batch_size", "reuse_size", "cutoff", "order"])
+    table.to_csv(args.output, index = False)
+
+    print(f"Ran {len(jobs)} configurations in {time.time() - start_time:.1f} s, results are in {args.output}")
+
+
+# Runs the positioning algorithm with the given parameters over a whole recording, returning its metrics.
+# Errors are recorded in the results, rather than stopping the sweep.
+def run_configuration(job):
+    path, mode, batch_size, reuse_size, cutoff, order = job
+    result = { "input": path, "mode": mode, "batch_size": batch_size, "reuse_size": reuse_size, "cutoff": cutoff, "order": order }
+
+    try:
+        result.update(measure(*job))
+
+    except Exception as ex:
+        result["error"] = repr(ex)
+
+    return result
+
+
+def measure(path, mode, batch_size, reuse_size, cutoff, order):
+    stream = open_stream(path)
+    sensor = Sensor(stream, batch_size, reuse_size, mode, fetch = False, session_path = None, publish_to = [],
+                    spill = False, cutoff = cutoff, order = order)
+    sensor.toggle_recording()
+
+    batch_lengths = []
+    batch_seconds = []
+
+    try:
+        while True:
+            try:
+                raw_data = stream.readlines(batch_size)
+
+            except EOFError:
+                break
+
+            start = time.perf_counter()
+
+            try:
+                new_data = sensor.process_batch(raw_data)
+
+            except AssertionError:
+                continue # still collecting the calibration data
+
+            if new_data is not None:
+                batch_seconds.append(time.perf_counter() - start)
+                batch_lengths.append(len(new_data))
+
+    finally:
+        sensor.close()
+
+    time_sec = sensor.accumulated_processed.column("time_sec")
+    position = sensor.accumulated_processed.array(["x", "y", "z"])
+    projected = sensor.accumulated_processed.array(["projected_X", "projected_Y"])
+    projected_variances = np.maximum(0, np.linalg.eigvalsh(np.cov(projected, rowvar = False)))[::-1]
+    batch_seconds = np.array(batch_seconds[1:]) # leaving out the calibration
+
+    return {
+        "samples":         len(time_sec),
+        "drift":           drift(time_sec, position),
+        "spread":          float(np.sqrt(np.mean(np.sum((position - position.mean(axis = 0)) ** 2, axis = 1)))),
+        "stability":       float(projected_variances.sum()),
+        "ellipse_major":   float(np.sqrt(projected_variances[0])),
+        "ellipse_minor":   float(np.sqrt(projected_variances[1])),
+        "seam_ratio":      seam_ratio(position, batch_lengths),
+        "p50_ms":          float(1000 * np.percentile(batch_seconds, 50)),
+        "p99_ms":          float(1000 * np.percentile(batch_seconds, 99)),
+        "realtime_factor": float((time_sec[-1] - time_sec[batch_lengths[0] - 1]) / batch_seconds.sum())
+    }
+
+
+# The speed of the position's overall linear trend (from a least-squares fit of each axis against time)
+def drift(time_sec, position):
+    slopes = np.polyfit(time_sec - time_sec[0], position, 1)[0]
+
+    return float(np.linalg.norm(slopes))
+
+
+# The mean step in position from the last sample of a batch to the first of the next,
+# over the mean step between samples within batches
+def seam_ratio(position, batch_lengths):
+    steps = np.linalg.norm(np.diff(position, axis = 0), axis = 1)
+
+    seams = np.zeros(len(steps), dtype = bool)
+    seams[np.cumsum(batch_lengths)[:-1] - 1] = True # step i goes from sample i to i + 1
+
+    if not seams.any() or seams.all():
+        return float("nan")
+
+    return float(steps[seams].mean() / steps[~seams].mean())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 # Math tools
 
-import pandas as pd
 import numpy as np
-import sklearn.decomposition
 from scipy import signal
 #from scipy.integrate import simps
 
@@ -14,6 +12,10 @@ def project_3D_to_2D(points, vec):
     P = np.array([vec[1], -vec[0], 0])
     Q = np.array([vec[0] * vec[2], vec[1] * vec[2], -(vec[0] ** 2 + vec[1] ** 2)])
 
+    if not P.any():
+        # vec is along z (eg. the principal axis of a single point), so the plane is just x,y
+        P, Q = np.array([1.0, 0, 0]), np.array([0, 1.0, 0])
+
     P /= np.sqrt(np.sum(P ** 2))
     Q /= np.sqrt(np.sum(Q ** 2))
 
@@ -22,56 +24,241 @@ def project_3D_to_2D(points, vec):
 
     return pts_on_plane
 
+# points: Nx3 matrix of x,y,z points
+# vecs: Nx3 matrix, one vector per point
+# As project_3D_to_2D, but projects each point onto the plane perpendicular to its own vector,
+# all at once, returning Nx2 matrix of 2D points
+def project_each_3D_to_2D(points, vecs):
+    vecs = np.asarray(vecs, dtype = np.float64)
+
+    P = np.stack([vecs[:, 1], -vecs[:, 0], np.zeros(vecs.shape[0])], axis = 1)
+    Q = np.stack([vecs[:, 0] * vecs[:, 2], vecs[:, 1] * vecs[:, 2], -(vecs[:, 0] ** 2 + vecs[:, 1] ** 2)], axis = 1)
+
+    along_z = ~P.any(axis = 1)
+    P[along_z] = [1.0, 0, 0]
+    Q[along_z] = [0, 1.0, 0]
+
+    P /= np.sqrt(np.sum(P ** 2, axis = 1, keepdims = True))
+    Q /= np.sqrt(np.sum(Q ** 2, axis = 1, keepdims = True))
+
+    proj_mats = np.stack((P, Q), axis = 2) # N x 3 x 2
+
+    return np.einsum("ni,nij->nj", points, proj_mats)
+
 # Filter and integrate a column (high pass filter removes low freq noise,
 #   aka the constant drift that the sensor reports... keeping just the interesting motion we do)
 # https://forums.adafruit.com/viewtopic.php?f=8&t=81842&hilit=bno055+position&start=0#p414708
-def filter_and_integrate(data_vector, time_vector):
+# cutoff: the high pass filter's cutoff frequency, in Hz
+# order: the order of the (Butterworth) high pass filter
+# Given an NxC matrix, each of its columns is filtered and integrated (all at once).
+# out: an array to write the result to, rather than a new one
+def filter_and_integrate(data_vector, time_vector, cutoff = 0.36, order = 5, out = None):
     samp_rate = data_vector.shape[0] / (time_vector.max() - time_vector.min())
-    b, a = signal.butter(5, 0.36 * 2 / samp_rate, "high")
-    filtered_vector = signal.filtfilt(b, a, data_vector)
-
-    return np.cumsum(filtered_vector / samp_rate) # simps(filtered_vector, time_vector) ?
-
-# Get the principal components and rotation matrix of the given dataset
-def PCA(df):
-    pca = sklearn.decomposition.PCA()
-    components = pca.fit_transform(df)
-    rotation = pca.components_.T
-
-    components = pd.DataFrame(components, columns=(f"PC{i}" for i,_ in enumerate(df.columns)))
-
-    return rotation, components
-
-# a 3D matrix, each R[:, :, i] is the rotation matrix of quaternion sample i
-def quaternions_as_rotation_matrix(qw, qx, qy, qz):
-    q_norm = np.sqrt(qw ** 2 + qx ** 2 + qy ** 2 + qz ** 2)
-    qw /= q_norm
-    qx /= q_norm
-    qy /= q_norm
-    qz /= q_norm
-
-    R = np.zeros((3, 3, qw.shape[0]))
-    R[0, 0, :] = 1 - 2*(qy**2 + qz**2)
-    R[1, 0, :] = 2*(qx*qy + qz*qw)
-    R[2, 0, :] = 2*(qx*qz - qy*qw)
-    R[0, 1, :] = 2*(qx*qy - qz*qw)
-    R[1, 1, :] = 1 - 2*(qx**2 + qz**2)
-    R[2, 1, :] = 2*(qy*qz + qx*qw)
-    R[0, 2, :] = 2*(qx*qz + qy*qw)
-    R[1, 2, :] = 2*(qy*qz - qx*qw)
-    R[2, 2, :] = 1 - 2 * (qx ** 2 + qy ** 2)
-    
-    return R
-
-# M: an Nx3 matrix
-# R: a 3x3xN array
-# Rotates each row in M using the corresponding 3x3 rotation matrix in R
-def rotate_each_row(M, R):
-    colnames = M.columns
-    M = M.to_numpy()
-    M2 = M.copy()
-
-    for row in range(M.shape[0]):
-        M2[row, :] = np.matmul(M[row, :], R[:, :, row])
-        
-    return pd.DataFrame(M2, columns=colnames)
\ No newline at end of file
+    b, a = signal.butter(order, cutoff * 2 / samp_rate, "high")
+    filtered_vector = signal.filtfilt(b, a, data_vector, axis = 0)
+    filtered_vector /= samp_rate
+
+    return np.cumsum(filtered_vector, axis = 0, out = out) # simps(filtered_vector, time_vector) ?
+
+# A causal counterpart to filter_and_integrate, for data arriving a batch at a time.
+# The filter's state (second-order sections and their initial conditions) and the running
+# integral are kept between calls, so each call only costs as much as the new samples given to it.
+# Being causal, it trades filtfilt's zero phase for not having to revisit old data.
+class StreamingFilterIntegrator:
+    def __init__(self, samp_rate, n_channels, cutoff = 0.36, order = 5):
+        self.samp_rate = samp_rate
+        self.sos = signal.butter(order, cutoff * 2 / samp_rate, "high", output = "sos")
+        self.zi = None
+        self.integral = np.zeros(n_channels)
+
+    # data: NxC matrix of new samples, one column per channel
+    # Returns NxC matrix of the filtered and integrated samples, continuing on from the last call
+    def process(self, data):
+        if self.zi is None:
+            # Start as if the filter had always been seeing the first sample, to avoid a startup transient
+            self.zi = signal.sosfilt_zi(self.sos)[:, :, np.newaxis] * data[0]
+
+        filtered, self.zi = signal.sosfilt(self.sos, data, axis = 0, zi = self.zi)
+        integrated = self.integral + np.cumsum(filtered / self.samp_rate, axis = 0)
+
+        if integrated.shape[0] > 0:
+            self.integral = integrated[-1]
+
+        return integrated
+
+# A per-sample alternative to filtering and integrating twice: a Kalman filter tracking each channel's
+# position, velocity and acceleration bias (eg. gravity that the quaternion rotation left behind), all
+# updated in constant time per sample, so there is no window to revisit and batches can be as small as one.
+# Each channel is integrated from its acceleration, with the steps between samples taken from their timestamps.
+# Left at that, integration would drift off, so every sample also counts as a weak measurement of the
+# instrument being at rest at the origin. How weak sets how quickly the drift is pulled back, much like
+# the cutoff of the high-pass filters: position_noise and velocity_noise are the spreads the movements
+# are expected to have around rest, and the smaller they are, the harder they're pulled back.
+# accel_noise and bias_noise are how much the acceleration and its bias can change (per sqrt(s)).
+# At 100 Hz, the defaults pass movements of 1 Hz and faster much as plain integration would,
+# and keep drift of 0.1 Hz and slower down to a sixth (in velocity) and a fiftieth (in position).
+# The channels share one covariance (they have the same model and timestamps), so it's only updated once per sample.
+class KalmanIntegrator:
+    def __init__(self, n_channels, accel_noise = 0.1, bias_noise = 0.1, position_noise = 0.1, velocity_noise = 1.0):
+        self.accel_noise = accel_noise
+        self.bias_noise = bias_noise
+        self.measurement_noise = np.diag([position_noise ** 2, velocity_noise ** 2])
+
+        self.state = np.zeros((3, n_channels)) # rows: position, velocity, bias
+        self.covariance = np.diag([position_noise ** 2, velocity_noise ** 2, 1.0])
+        self.last_time = None
+        self.last_dt = None
+
+    # acceleration: NxC matrix of new samples, one column per channel, taken at the N given times (in seconds)
+    # Returns (velocity, position), NxC matrices of the estimates after each sample
+    def process(self, acceleration, times):
+        acceleration = np.asarray(acceleration, dtype = np.float64)
+        times = np.asarray(times, dtype = np.float64)
+
+        velocity = np.empty_like(acceleration)
+        position = np.empty_like(acceleration)
+        observed = np.array([[1.0, 0, 0], [0, 1.0, 0]]) # we "measure" position and velocity (as zero)
+
+        for i in range(acceleration.shape[0]):
+            dt = self._time_step(times[i])
+
+            # Predict: integrate the bias-corrected acceleration over the step
+            transition = np.array([[1, dt, -dt * dt / 2], [0, 1, -dt], [0, 0, 1]])
+            self.state = np.matmul(transition, self.state)
+            self.state[:2] += np.outer([dt * dt / 2, dt], acceleration[i])
+
+            noise = self.accel_noise ** 2 * dt * np.array([[dt ** 2 / 3, dt / 2, 0], [dt / 2, 1, 0], [0, 0, 0]])
+            noise[2, 2] = self.bias_noise ** 2 * dt
+            self.covariance = np.matmul(np.matmul(transition, self.covariance), transition.T) + noise
+
+            # Correct: pull position and velocity towards rest
+            innovation_covariance = self.covariance[:2, :2] + self.measurement_noise
+            gain = np.linalg.solve(innovation_covariance, self.covariance[:2]).T # 3x2, as innovation_covariance is symmetric
+
+            self.state -= np.matmul(gain, self.state[:2])
+            self.covariance -= np.matmul(gain, np.matmul(observed, self.covariance))
+
+            position[i] = self.state[0]
+            velocity[i] = self.state[1]
+
+        return velocity, position
+
+    # The time since the last sample. The first sample, and any that go back in time (eg. when the sensor restarts),
+    # are taken to be as far apart as the last two were
+    def _time_step(self, time):
+        dt = None if self.last_time is None else time - self.last_time
+        self.last_time = time
+
+        if dt is None or dt <= 0:
+            return self.last_dt or 0.0
+
+        self.last_dt = dt
+        return dt
+
+# Get the principal components and rotation matrix of the given Nx3 dataset (one column per axis).
+# The rotation's columns are the principal axes in order of decreasing variance, and the
+# components are the Nx3 matrix of the (centered) data's coordinates along those axes.
+# reference: a previous rotation (eg. the last batch's), which the axes' signs are made to agree with
+def PCA(data, reference = None):
+    data = np.asarray(data, dtype = np.float64)
+    centered = data - data.mean(axis = 0)
+
+    covariance = np.matmul(centered.T, centered) / max(1, data.shape[0] - 1)
+    rotation = principal_axes(covariance, reference)
+
+    return rotation, np.matmul(centered, rotation)
+
+# Eigenvectors of a (3x3) covariance matrix, as the columns of a rotation matrix in order of decreasing eigenvalue.
+# An eigenvector's sign is arbitrary, so it is chosen to point the same way as the matching column of reference,
+# or without one, so that its largest entry is positive. Otherwise the PC traces could flip between batches.
+def principal_axes(covariance, reference = None):
+    _, eigenvectors = np.linalg.eigh(covariance) # ascending order
+    rotation = eigenvectors[:, ::-1]
+
+    if reference is None:
+        signs = np.sign(rotation[np.argmax(np.abs(rotation), axis = 0), np.arange(rotation.shape[1])])
+
+    else:
+        signs = np.sign(np.sum(rotation * reference, axis = 0))
+
+    signs[signs == 0] = 1
+
+    return rotation * signs
+
+# Principal axes of a stream of points, kept up to date from running sums rather than the points themselves,
+# so each update only costs as much as the new points. Given a window, older points are exponentially
+# forgotten, with a time constant of roughly that many points. Otherwise, every point counts equally.
+class RunningPCA:
+    def __init__(self, n_dims = 3, window = None):
+        self.forget = 1.0 if window is None else 1 - 1 / window
+
+        self.weight = 0.0
+        self.sum = np.zeros(n_dims)
+        self.sum_of_outers = np.zeros((n_dims, n_dims))
+
+        self.mean = np.zeros(n_dims)
+        self.covariance = np.zeros((n_dims, n_dims))
+        self.rotation = None
+
+    # data: Nxd matrix of new points. Returns the updated rotation matrix, as in PCA()
+    def update(self, data):
+        data = np.asarray(data, dtype = np.float64)
+        n = data.shape[0]
+
+        weights = self.forget ** np.arange(n - 1, -1, -1) # the newest point has weight 1
+        decay = self.forget ** n
+
+        self.weight = self.weight * decay + weights.sum()
+        self.sum = self.sum * decay + np.matmul(weights, data)
+        self.sum_of_outers = self.sum_of_outers * decay + np.matmul(data.T * weights, data)
+
+        self.mean = self.sum / self.weight
+        self.covariance = self.sum_of_outers / self.weight - np.outer(self.mean, self.mean)
+        self.rotation = principal_axes(self.covariance, self.rotation)
+
+        return self.rotation
+
+    # Updates with the points one at a time, as if each were its own batch, so the result doesn't depend on how
+    # the points are batched. Returns each point's coordinates along the axes as they were just after it,
+    # and those axes (as an Nxdxd array of rotation matrices)
+    def update_each(self, data):
+        data = np.asarray(data, dtype = np.float64)
+        components = np.empty_like(data)
+        rotations = np.empty((data.shape[0], data.shape[1], data.shape[1]))
+
+        for i, point in enumerate(data):
+            self.weight = self.weight * self.forget + 1
+            self.sum = self.sum * self.forget + point
+            self.sum_of_outers = self.sum_of_outers * self.forget + np.outer(point, point)
+
+            self.mean = self.sum / self.weight
+            self.covariance = self.sum_of_outers / self.weight - np.outer(self.mean, self.mean)
+            self.rotation = principal_axes(self.covariance, self.rotation)
+
+            components[i] = np.dot(point - self.mean, self.rotation)
+            rotations[i] = self.rotation
+
+        return components, rotations
+
+    # The coordinates of the given points along the current principal axes
+    def transform(self, data):
+        return np.matmul(np.asarray(data) - self.mean, self.rotation)
+
+# quaternions: Nx4 matrix of (qw, qx, qy, qz) orientation samples
+# acceleration: Nx3 matrix of (ax, ay, az) samples, in the sensor's frame
+# Rotates each acceleration sample by the inverse of its orientation quaternion,
+# returning Nx3 matrix of linear acceleration. Equivalent to multiplying each row by the
+# quaternion's 3x3 rotation matrix, but done for all rows at once without building the matrices.
+# The quaternions are normalized on a copy, so the caller's data is left untouched.
+# dtype: pass np.float32 to halve the memory traffic of large windows, at the cost of precision
+def rotate_by_quaternions(quaternions, acceleration, dtype = np.float64):
+    q = np.asarray(quaternions, dtype = dtype)
+    v = np.asarray(acceleration, dtype = dtype)
+
+    q = q / np.sqrt(np.sum(q ** 2, axis = 1, keepdims = True))
+    w, u = q[:, :1], q[:, 1:]
+
+    # v' = v - 2w(u x v) + 2u x (u x v), ie. rotation by the conjugate quaternion
+    t = 2 * np.cross(u, v)
+
+    return v - w * t + np.cross(u, t)
\ No newline at end of file